@@ -0,0 +1,396 @@
+"""Benchmarks for tabtabtab, run outside of Nuke
+
+Times searching, per-keystroke model updates, batches of searches
+with SearchEngine, weight loading/saving and walking the menus, for
+the menu items in data_test.py and for larger synthetic catalogs built
+from them. Results are written as JSON, so they can be compared between
+versions:
+
+    python benchmark.py --output before.json
+    python benchmark.py --sizes 288,10000 --output after.json
+
+Runs with Qt's offscreen platform, with a stand-in "nuke" module
+providing menus when the real one is not available.
+
+Importing tabtabtab is timed in a fresh interpreter, which also checks
+that no Qt binding is imported until the dialog is needed.
+"""
+
+import os
+import sys
+import json
+import random
+import shutil
+import tempfile
+import optparse
+import platform
+import subprocess
+from timeit import default_timer as timer
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from data_test import menu_items
+
+
+# Queries typed one character at a time, as an artist would. "\b" is
+# backspace
+QUERY_SEQUENCES = [
+    "blur",
+    "tra",
+    "mrg",
+    "grade",
+    "rdg",
+    "trage",
+    "ax  3",
+    "ax[3d",
+    " grade [color]",
+    " scen",
+    "shuff\b\b\b\bcopy",
+    "colr\b\borr",
+    "t",
+    "e",
+]
+
+
+# Modules which importing tabtabtab should not load
+QT_MODULES = ("PySide2", "PySide", "PyQt4", "PyQt5", "sip")
+
+IMPORT_SCRIPT = """
+import sys, json
+from timeit import default_timer as timer
+start = timer()
+import tabtabtab
+elapsed = timer() - start
+json.dump({'seconds': elapsed,
+           'qt_modules': [m for m in %r if m in sys.modules]}, sys.stdout)
+""" % (QT_MODULES, )
+
+
+class FakeMenuItem(object):
+    """Stands in for nuke.MenuItem
+    """
+    def __init__(self, name):
+        self._name = name
+
+    def name(self):
+        return self._name
+
+    def invoke(self):
+        pass
+
+
+class FakeMenu(FakeMenuItem):
+    """Stands in for nuke.Menu
+    """
+    def __init__(self, name):
+        super(FakeMenu, self).__init__(name)
+        self._items = []
+        self._submenus = {}
+
+    def items(self):
+        return list(self._items)
+
+    def addCommand(self, path):
+        menu = self
+        parts = path.split("/")
+        for part in parts[:-1]:
+            if part not in menu._submenus:
+                sub = FakeMenu(part)
+                menu._submenus[part] = sub
+                menu._items.append(sub)
+            menu = menu._submenus[part]
+        item = FakeMenuItem(parts[-1])
+        menu._items.append(item)
+        return item
+
+
+def install_fake_nuke(menupaths):
+    """Makes "import nuke" give a module with a Nodes menu containing
+    menupaths, unless the real nuke module is available
+    """
+    try:
+        import nuke
+        if hasattr(nuke, "menu"):
+            return nuke
+    except ImportError:
+        pass
+
+    import imp
+    nuke = imp.new_module("nuke")
+    nuke.Menu = FakeMenu
+    nuke.MenuItem = FakeMenuItem
+    nuke.NUKE_VERSION_STRING = "benchmark"
+    nuke.pluginPath = lambda: []
+
+    menus = {"Nodes": FakeMenu("Nodes"), "Nuke": FakeMenu("Nuke")}
+    nuke.menu = lambda name: menus[name]
+    nuke._set_nodes = lambda paths: _fill_menu(menus, paths)
+
+    sys.modules["nuke"] = nuke
+    nuke._set_nodes(menupaths)
+    return nuke
+
+
+def _fill_menu(menus, menupaths):
+    menus["Nodes"] = FakeMenu("Nodes")
+    for path in menupaths:
+        menus["Nodes"].addCommand(path)
+
+
+def synthetic_catalog(size, seed = 0):
+    """Returns size menu paths, starting with data_test.menu_items and
+    padded with gizmo-like entries built from them
+    """
+    rng = random.Random(seed)
+    paths = list(menu_items[:size])
+
+    n = 0
+    while len(paths) < size:
+        base = rng.choice(menu_items).rpartition("/")[2]
+        paths.append("Gizmos/Show%03d/%s/%s_v%d" % (
+            n % 300, rng.choice(["Comp", "Key", "Light", "Util"]), base, n))
+        n += 1
+
+    return paths
+
+
+def stats(samples):
+    """Summary of a list of durations, in milliseconds
+    """
+    samples = sorted(samples)
+    count = len(samples)
+    return {
+        'count': count,
+        'total_ms': sum(samples) * 1000,
+        'mean_ms': sum(samples) / count * 1000,
+        'median_ms': samples[count // 2] * 1000,
+        'p95_ms': samples[min(count - 1, int(count * 0.95))] * 1000,
+        'max_ms': samples[-1] * 1000,
+        }
+
+
+def typed(sequence):
+    """Yields the filter text after each keystroke of sequence
+    """
+    text = ""
+    for char in sequence:
+        if char == "\b":
+            text = text[:-1]
+        else:
+            text += char
+        yield text
+
+
+def bench_find(tabtabtab, entries, repeat):
+    queries = [q for seq in QUERY_SEQUENCES for q in typed(seq)]
+
+    def run(find):
+        samples = []
+        for _ in range(repeat):
+            for q in queries:
+                start = timer()
+                find(q)
+                samples.append(timer() - start)
+        return stats(samples)
+
+    def reference(q):
+        for e in entries:
+            tabtabtab.nonconsec_find(q, e.full, anchored = True)
+
+    def matcher(q):
+        m = tabtabtab.Matcher(q, anchored = True)
+        for e in entries:
+            m(e)
+
+    return {
+        'nonconsec_find': run(reference),
+        'matcher': run(matcher),
+        }
+
+
+def bench_model(tabtabtab, items, weights, repeat):
+    model = tabtabtab.NodeModel(items, weights = weights)
+
+    keystrokes = []
+    for _ in range(repeat):
+        for seq in QUERY_SEQUENCES:
+            model.set_filter("")
+            for text in typed(seq):
+                start = timer()
+                model.set_filter(text)
+                keystrokes.append(timer() - start)
+
+    start = timer()
+    tabtabtab.NodeModel(items, weights = weights)
+    build = timer() - start
+
+    return {
+        'build_ms': build * 1000,
+        'keystroke': stats(keystrokes),
+        }
+
+
+def bench_engine(tabtabtab, items, weights, repeat):
+    """Times SearchEngine.search_many for every keystroke of the
+    QUERY_SEQUENCES, without Qt
+    """
+    queries = [q for seq in QUERY_SEQUENCES for q in typed(seq)]
+    index = tabtabtab.build_index(items)
+
+    samples = []
+    for _ in range(repeat):
+        engine = tabtabtab.SearchEngine(items, weights, index = index)
+        start = timer()
+        engine.search_many(queries)
+        samples.append(timer() - start)
+
+    return {
+        'queries': len(queries),
+        'search_many': stats(samples),
+        }
+
+
+def bench_weights(tabtabtab, paths, repeat):
+    rng = random.Random(1)
+    tmp = tempfile.mkdtemp()
+    try:
+        fname = os.path.join(tmp, "weights.json")
+        weights = tabtabtab.NodeWeights(fname)
+        weights.load()
+        for path in rng.sample(paths, min(len(paths), 2000)):
+            for _ in range(rng.randint(1, 20)):
+                weights.increment(path)
+        weights.save()
+
+        loads, saves, gets = [], [], []
+        for _ in range(repeat):
+            fresh = tabtabtab.NodeWeights(fname)
+            start = timer()
+            fresh.load()
+            loads.append(timer() - start)
+
+            fresh.increment(paths[0])
+            start = timer()
+            fresh.save()
+            saves.append(timer() - start)
+
+            start = timer()
+            fresh.get_many(paths)
+            gets.append(timer() - start)
+
+        return {
+            'load': stats(loads),
+            'save': stats(saves),
+            'get_many_catalog': stats(gets),
+            'count': len(weights._weights),
+            }
+    finally:
+        shutil.rmtree(tmp)
+
+
+def bench_menus(tabtabtab, nuke, paths, repeat):
+    if hasattr(nuke, "_set_nodes"):
+        # Otherwise times the real Nuke menus
+        nuke._set_nodes(paths)
+    samples = []
+    for _ in range(repeat):
+        start = timer()
+        tabtabtab.find_menu_items(nuke.menu("Nodes"))
+        samples.append(timer() - start)
+    return stats(samples)
+
+
+def bench_import(repeat):
+    """Times importing tabtabtab in a new interpreter, returning the
+    stats and any Qt modules it imported
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    samples = []
+    qt_modules = set()
+    for _ in range(max(repeat, 5)):
+        output = subprocess.check_output([sys.executable, "-c", IMPORT_SCRIPT], cwd = here)
+        result = json.loads(output)
+        samples.append(result['seconds'])
+        qt_modules.update(result['qt_modules'])
+
+    if len(qt_modules) > 0:
+        sys.stderr.write("Warning: importing tabtabtab imported %s\n" % ", ".join(sorted(qt_modules)))
+
+    return {
+        'time': stats(samples),
+        'qt_modules': sorted(qt_modules),
+        }
+
+
+def run(tabtabtab, nuke, sizes, repeat):
+    results = {
+        'tabtabtab_version': tabtabtab.__version__,
+        'python': platform.python_version(),
+        'import': bench_import(repeat),
+        'queries': QUERY_SEQUENCES,
+        'catalogs': {},
+        }
+
+    for size in sizes:
+        paths = synthetic_catalog(size)
+        items = [{'menuobj': FakeMenuItem(p.rpartition("/")[2]), 'menupath': p}
+                 for p in paths]
+
+        weights = tabtabtab.NodeWeights()
+        rng = random.Random(2)
+        for path in rng.sample(paths, min(len(paths), 500)):
+            for _ in range(rng.randint(1, 20)):
+                weights.increment(path)
+
+        entries = tabtabtab.build_index(items)
+
+        results['catalogs'][str(size)] = {
+            'find': bench_find(tabtabtab, entries, repeat),
+            'model': bench_model(tabtabtab, items, weights, repeat),
+            'engine': bench_engine(tabtabtab, items, weights, repeat),
+            'weights': bench_weights(tabtabtab, paths, repeat),
+            'find_menu_items': bench_menus(tabtabtab, nuke, paths, repeat),
+            }
+
+    return results
+
+
+def main():
+    parser = optparse.OptionParser(usage = "%prog [options]")
+    parser.add_option("--sizes", default = "%d,10000,100000" % len(menu_items),
+                      help = "comma separated catalog sizes [default: %default]")
+    parser.add_option("--repeat", type = "int", default = 3,
+                      help = "times to repeat each measurement [default: %default]")
+    parser.add_option("--output", default = None,
+                      help = "file to write JSON results to, instead of stdout")
+    opts, args = parser.parse_args()
+
+    sizes = [int(s) for s in opts.sizes.split(",")]
+
+    nuke = install_fake_nuke(menu_items)
+
+    import tabtabtab
+    tabtabtab.load_qt()
+
+    # NodeModel needs a QApplication
+    app = tabtabtab.QtWidgets.QApplication(sys.argv)
+
+    # Keep anything tabtabtab prints out of the JSON
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        results = run(tabtabtab, nuke, sizes, opts.repeat)
+    finally:
+        sys.stdout = stdout
+
+    if opts.output is None:
+        json.dump(results, sys.stdout, indent = 2, sort_keys = True)
+        sys.stdout.write("\n")
+    else:
+        f = open(opts.output, "w")
+        json.dump(results, f, indent = 2, sort_keys = True)
+        f.close()
+
+
+if __name__ == '__main__':
+    main()
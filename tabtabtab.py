@@ -2,31 +2,169 @@
 
 homepage: https://github.com/dbr/tabtabtab-nuke
 license: http://unlicense.org/
+
+The classes using Qt (NodeModel, TabTabTabWidget etc) are None until
+load_qt() is called, which main() and warmup() do
 """
 
 __version__ = "1.8"
 
 import os
 import sys
+import time
+import heapq
+import bisect
+import threading
+
+# The Qt binding is imported by load_qt() when the dialog is first
+# needed, so importing tabtabtab from menu.py doesn't slow down Nuke
+# starting up
+QtCore = QtGui = QtWidgets = Qt = None
+
+
+def _import_qt():
+    """Imports the first available of PySide2, PySide or PyQt4 as the
+    QtCore, QtGui, QtWidgets and Qt globals
+    """
+    global QtCore, QtGui, QtWidgets, Qt
 
-try:
-    from PySide2 import QtCore, QtGui, QtWidgets
-    from PySide2.QtCore import Qt
-except ImportError:
     try:
-        from PySide import QtCore, QtGui, QtGui as QtWidgets
-        from PySide.QtCore import Qt
+        from PySide2 import QtCore, QtGui, QtWidgets
+        from PySide2.QtCore import Qt
     except ImportError:
-        import sip
-        for mod in ("QDate", "QDateTime", "QString", "QTextStream", "QTime", "QUrl", "QVariant"):
-            sip.setapi(mod, 2)
+        try:
+            from PySide import QtCore, QtGui, QtGui as QtWidgets
+            from PySide.QtCore import Qt
+        except ImportError:
+            import sip
+            for mod in ("QDate", "QDateTime", "QString", "QTextStream", "QTime", "QUrl", "QVariant"):
+                sip.setapi(mod, 2)
+
+            from PyQt4 import QtCore, QtGui
+            from PyQt4.QtCore import Qt
+            QtCore.Signal = QtCore.pyqtSignal
+
+
+class _PhaseTimer(object):
+    def __init__(self, timings, phase):
+        self.timings = timings
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings.record(self.phase, time.time() - self.start)
+
+
+class _NoTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+_no_timer = _NoTimer()
+
+
+class PhaseTimings(object):
+    """Keeps the most recent durations of named phases (loading weights,
+    filtering the list etc), to find out what is slow in production.
+
+    Does nothing unless enabled, either by setting the TABTABTAB_TIMINGS
+    environment variable or with enable_timings(). Timings can then be
+    checked from the script editor with tabtabtab.timings.report(), or
+    written to a file with tabtabtab.timings.dump(fname)
+
+    >>> t = PhaseTimings()
+    >>> t.enabled = True
+    >>> with t.timed("example"):
+    ...     pass
+    >>> t.report()['example']['count']
+    1
+    """
+
+    def __init__(self, size = 500):
+        self.enabled = False
+        self.size = size
+        self._samples = {}
+
+        # Held while changing or reading the samples, as phases are
+        # recorded on the FilterWorker thread too
+        self._lock = threading.Lock()
+
+    def timed(self, phase):
+        """Context manager recording the duration of the "with" block
+        """
+        if not self.enabled:
+            return _no_timer
+        return _PhaseTimer(self, phase)
+
+    def record(self, phase, seconds):
+        if not self.enabled:
+            return
+
+        import collections
+        with self._lock:
+            if phase not in self._samples:
+                self._samples[phase] = collections.deque(maxlen = self.size)
+            self._samples[phase].append(seconds)
+
+    def reset(self):
+        with self._lock:
+            self._samples = {}
+
+    def report(self):
+        """Summary of each phase's recent durations, in milliseconds,
+        including a histogram with power-of-two millisecond buckets
+        """
+        with self._lock:
+            phases = [(phase, list(samples)) for phase, samples in self._samples.items()]
+
+        report = {}
+        for phase, samples in phases:
+            ms = sorted(s * 1000 for s in samples)
+            count = len(ms)
+
+            histogram = {}
+            for v in ms:
+                bucket = 1
+                while v > bucket:
+                    bucket *= 2
+                label = "<=%dms" % bucket
+                histogram[label] = histogram.get(label, 0) + 1
+
+            report[phase] = {
+                'count': count,
+                'mean_ms': sum(ms) / count,
+                'median_ms': ms[count // 2],
+                'p95_ms': ms[min(count - 1, int(count * 0.95))],
+                'max_ms': ms[-1],
+                'histogram': histogram,
+                }
+        return report
+
+    def dump(self, fname):
+        """Writes report() to fname as JSON
+        """
+        import json
+        f = open(fname, "w")
+        json.dump(self.report(), f, indent = 2, sort_keys = True)
+        f.close()
 
-        from PyQt4 import QtCore, QtGui
-        from PyQt4.QtCore import Qt
-        QtCore.Signal = QtCore.pyqtSignal
 
+timings = PhaseTimings()
+timings.enabled = os.environ.get("TABTABTAB_TIMINGS", "") not in ("", "0")
 
-def find_menu_items(menu, _path = None):
+
+def enable_timings(enabled = True):
+    """Turns recording of tabtabtab.timings on or off
+    """
+    timings.enabled = enabled
+
+
+def find_menu_items(menu, _path = None, _names = ()):
     """Extracts items from a given Nuke menu
 
     Returns a list of strings, with the path to each item
@@ -38,37 +176,324 @@ def find_menu_items(menu, _path = None):
     >>> found[:5]
     ['3D/Axis', '3D/Camera', '3D/CameraTracker', '3D/DepthGenerator', '3D/Geometry/Card']
     """
-    import nuke
-
     found = []
 
     mi = menu.items()
     for i in mi:
-        if isinstance(i, nuke.Menu):
-            # Sub-menu, recurse
-            mname = i.name().replace("&", "")
-            subpath = "/".join(x for x in (_path, mname) if x is not None)
+        found.extend(_find_item(i, _path = _path, _names = _names))
 
-            if "ToolSets/Delete" in subpath:
-                # Remove all ToolSets delete commands
-                continue
+    return found
+
+
+def _find_item(i, _path = None, _names = ()):
+    """find_menu_items for a single item in a menu
+    """
+    child = _menu_child(i, _path, _names)
+
+    if isinstance(child, dict):
+        return [child]
+
+    elif child is not None:
+        # Sub-menu, recurse
+        subpath, name = child
+        return find_menu_items(menu = i, _path = subpath, _names = _names + (name, ))
+
+    return []
 
-            sub_found = find_menu_items(menu = i, _path = subpath)
-            found.extend(sub_found)
-        elif isinstance(i, nuke.MenuItem):
-            if i.name() == "":
-                # Skip dividers
-                continue
-            if i.name().startswith("@;"):
-                # Skip hidden items
-                continue
 
-            subpath = "/".join(x for x in (_path, i.name()) if x is not None)
-            found.append({'menuobj': i, 'menupath': subpath})
+def _menu_child(i, path, names):
+    """Looks at a single item in a menu, without recursing into
+    sub-menus. Returns the item dict for a menu item, a (path, name)
+    pair for a sub-menu, or None for items which are skipped
+    """
+    import nuke
+
+    if isinstance(i, nuke.Menu):
+        mname = i.name().replace("&", "")
+        subpath = "/".join(x for x in (path, mname) if x is not None)
+
+        if "ToolSets/Delete" in subpath:
+            # Remove all ToolSets delete commands
+            return None
+
+        return (subpath, i.name())
+
+    elif isinstance(i, nuke.MenuItem):
+        name = i.name()
+        if name == "":
+            # Skip dividers
+            return None
+        if name.startswith("@;"):
+            # Skip hidden items
+            return None
+
+        return {'menuobj': i,
+                'menupath': "/".join(x for x in (path, name) if x is not None),
+                'menunames': list(names + (name, ))}
+
+    return None
+
 
+# Menus searched for items, in order
+MENU_ROOTS = ("Nodes", "Nuke")
+
+
+def find_nuke_menu_items():
+    """Items from all the MENU_ROOTS, as returned by find_menu_items,
+    with the name of the root menu in 'menuroot'
+    """
+    found = []
+    for items in iter_nuke_menu_items():
+        found.extend(items)
     return found
 
 
+def iter_nuke_menu_items():
+    """Generator for find_nuke_menu_items, yielding the items found
+    under each top level entry of the MENU_ROOTS in turn, so the walk
+    can be split into small steps
+    """
+    import nuke
+
+    for root in MENU_ROOTS:
+        # Time the whole walk of each root menu, not including the
+        # time spent by the caller between steps
+        elapsed = 0
+        for i in nuke.menu(root).items():
+            start = time.time()
+            items = _find_item(i)
+            for item in items:
+                item['menuroot'] = root
+            elapsed += time.time() - start
+            yield items
+        timings.record("menu_walk", elapsed)
+
+
+class LazyMenuItem(object):
+    """Stands in for a nuke.MenuItem loaded from MenuCache, only looking
+    up the real item when it is invoked
+    """
+
+    def __init__(self, root, names):
+        self.root = root
+        self.names = names
+
+    def name(self):
+        return self.names[-1]
+
+    def resolve(self):
+        """Finds the nuke.MenuItem, or returns None if it no longer exists
+        """
+        import nuke
+
+        item = nuke.menu(self.root)
+        for name in self.names:
+            found = [i for i in item.items() if i.name() == name]
+            if len(found) == 0:
+                return None
+            item = found[0]
+        return item
+
+    def invoke(self):
+        item = self.resolve()
+        if item is None:
+            print "Menu item %s no longer exists" % "/".join(self.names)
+            return
+        item.invoke()
+
+
+class MenuCache(object):
+    """Stores the items found by find_nuke_menu_items on disk, so the
+    menus don't need to be walked every session.
+
+    The cache is only used if it was written by the same Nuke version,
+    with the same NUKE_PATH and plugin paths
+    """
+
+    def __init__(self, fname = None):
+        self.fname = fname
+
+    def key(self):
+        """Identifies the Nuke version and plugin setup the menus came from
+        """
+        import nuke
+        import hashlib
+
+        nuke_path = os.environ.get("NUKE_PATH", "")
+        paths = [p for p in nuke_path.split(os.pathsep) if p != ""] + list(nuke.pluginPath())
+
+        fingerprint = hashlib.md5()
+        for path in paths:
+            # Include the modification time, so adding or removing
+            # gizmos invalidates the cache
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                mtime = None
+            fingerprint.update("%s %r\n" % (path, mtime))
+
+        return "%s %s %s" % (__version__, nuke.NUKE_VERSION_STRING, fingerprint.hexdigest())
+
+    def load(self):
+        """Returns the cached items, with LazyMenuItem's as the
+        'menuobj', or None if there is no usable cache
+        """
+        if self.fname is None or not os.path.isfile(self.fname):
+            return None
+
+        try:
+            import json
+            f = open(self.fname)
+            cached = json.load(f)
+            f.close()
+
+            if cached['key'] != self.key():
+                return None
+
+            return [{'menuobj': LazyMenuItem(root, names),
+                     'menupath': menupath,
+                     'menunames': names,
+                     'menuroot': root}
+                    for root, menupath, names in cached['items']]
+
+        except Exception:
+            print "Error loading menu cache"
+            import traceback
+            traceback.print_exc()
+            return None
+
+    def save(self, index):
+        """Writes the entries of a search index from build_index
+        """
+        if self.fname is None:
+            return
+
+        try:
+            cached = {
+                'key': self.key(),
+                'items': [(e.root, e.menupath, list(e.names)) for e in index],
+                }
+
+            write_json(self.fname, cached)
+
+        except Exception:
+            print "Error saving menu cache"
+            import traceback
+            traceback.print_exc()
+
+
+def same_menu_items(a, b):
+    """Checks if two search indexes (lists of CatalogEntry's) refer to
+    the same menu entries
+    """
+    def ident(index):
+        return [(e.root, e.menupath, e.names) for e in index]
+    return ident(a) == ident(b)
+
+
+class MenuTree(object):
+    """Walks the MENU_ROOTS like find_nuke_menu_items, remembering the
+    names of the items in each menu and the menu items found there.
+    Later walks only look at the items of menus where the names have
+    changed, and report which items were added or removed
+
+    >>> tree = MenuTree()
+    >>> entries, added, removed = tree.walk()
+    >>> same_menu_items(entries, build_index(find_nuke_menu_items()))
+    True
+    >>> tree.walk()[1:]
+    ([], [])
+    """
+
+    def __init__(self):
+        # (menuroot, menunames, n) -> (names of the items, children),
+        # where children has a CatalogEntry, a (path, name) pair for a
+        # sub-menu or None for each item. n counts menus with the
+        # same names
+        self._menus = {}
+        self.walked = False
+
+    def walk(self):
+        """Returns (entries, added, removed), where entries are the
+        search index (as from build_index) of the items
+        find_nuke_menu_items would find, added are the entries not found
+        by the previous walk and removed the menupaths of the ones no
+        longer found. The first walk adds every item
+        """
+        import nuke
+
+        menus = {}
+        found, added, removed = [], [], []
+        with timings.timed("menu_walk"):
+            for root in MENU_ROOTS:
+                self._walk(nuke.menu(root), root, None, (), menus, found, added, removed)
+
+        for key, (_, children) in self._menus.items():
+            if key not in menus:
+                # The whole menu has gone
+                removed.extend(c.menupath for c in children if isinstance(c, CatalogEntry))
+
+        if not self.walked:
+            # Number the new entries, so build_index can use them as
+            # they are
+            for n, e in enumerate(found):
+                e.id = n
+
+        self._menus = menus
+        self.walked = True
+        return found, added, removed
+
+    def adopt(self, index):
+        """Replaces the entries kept for the next walk with the ones in
+        index with the same root and menupath (such as the copies made
+        by SearchEngine.patch_items), so only one copy of each is kept
+        """
+        by_path = dict(((e.root, e.menupath), e) for e in index)
+        for _, children in self._menus.values():
+            for n, c in enumerate(children):
+                if isinstance(c, CatalogEntry):
+                    children[n] = by_path.get((c.root, c.menupath), c)
+
+    def _walk(self, menu, root, path, names, menus, found, added, removed):
+        items = menu.items()
+        signature = tuple(i.name() for i in items)
+
+        key = (root, names, 0)
+        while key in menus:
+            key = (root, names, key[2] + 1)
+
+        known = self._menus.get(key)
+        if known is not None and known[0] == signature:
+            children = known[1]
+        else:
+            if known is None:
+                old = {}
+            else:
+                old = dict((c.menupath, c) for c in known[1] if isinstance(c, CatalogEntry))
+
+            children = []
+            for i in items:
+                child = _menu_child(i, path, names)
+                if isinstance(child, dict):
+                    if child['menupath'] in old:
+                        child = old.pop(child['menupath'])
+                    else:
+                        child['menuroot'] = root
+                        child = index_entry(child)
+                        added.append(child)
+                children.append(child)
+            removed.extend(old)
+
+        menus[key] = (signature, children)
+
+        for i, child in zip(items, children):
+            if isinstance(child, CatalogEntry):
+                found.append(child)
+            elif child is not None:
+                subpath, name = child
+                self._walk(i, root, subpath, names + (name, ), menus, found, added, removed)
+
+
 def nonconsec_find(needle, haystack, anchored = False):
     """checks if each character of "needle" can be found in order (but not
     necessarily consecutivly) in haystack.
@@ -148,387 +573,2629 @@ def nonconsec_find(needle, haystack, anchored = False):
     return True
 
 
-class NodeWeights(object):
-    def __init__(self, fname = None):
-        self.fname = fname
-        self._weights = {}
-        self._successful_load = False
+def char_mask(s):
+    """Bitmask with a bit set for each character in s. If a needle has
+    bits which a haystack's mask doesn't, it can't be found in it (the
+    reverse is not true, as characters can share a bit)
 
-    def load(self):
-        if self.fname is None:
-            return
+    >>> char_mask("ab") & char_mask("cab") == char_mask("ab")
+    True
+    >>> char_mask("ax") & char_mask("cab") == char_mask("ax")
+    False
+    """
+    mask = 0
+    for c in s:
+        mask |= 1 << (ord(c) & 63)
+    return mask
 
-        def _load_internal():
-            import json
-            if not os.path.isfile(self.fname):
-                print "Weight file does not exist"
-                return
-            f = open(self.fname)
-            self._weights = json.load(f)
-            f.close()
 
-        # Catch any errors, print traceback and continue
-        try:
-            _load_internal()
-            self._successful_load = True
-        except Exception:
-            print "Error loading node weights"
-            import traceback
-            traceback.print_exc()
-            self._successful_load = False
+class CatalogEntry(object):
+    """A menu item in the search index, see index_entry
+    """
+    __slots__ = ('id', 'menupath', 'menuobj', 'root', 'names', 'cleanpath',
+                 'text', 'full', 'name', 'menu', 'full_mask', 'name_mask')
 
-    def save(self):
-        if self.fname is None:
-            print "Not saving node weights, no file specified"
-            return
+    def renumbered(self, id):
+        """Returns a copy of the entry with a different id. Entries are
+        never changed, as searches on other threads may be using them
+        """
+        e = CatalogEntry()
+        for attr in self.__slots__:
+            setattr(e, attr, getattr(self, attr))
+        e.id = id
+        return e
+
+
+def index_entry(item, id = 0):
+    """Precomputes the strings searched for a single item from
+    find_menu_items, so they are not rebuilt on every keystroke. id is
+    the entry's position in the index. An item which is already a
+    CatalogEntry is reused, or copied if its id differs
+
+    >>> e = index_entry({'menupath': '3D/Shader/&Phong', 'menuobj': None})
+    >>> e.text, e.name, e.menu
+    ('Phong [3D/Shader]', 'phong', '3d/shader')
+    >>> index_entry(e) is e, index_entry(e, id = 1).id
+    (True, 1)
+    """
+    if isinstance(item, CatalogEntry):
+        if item.id == id:
+            return item
+        return item.renumbered(id)
+
+    # Turn "3D/Shader/Phong" into "Phong [3D/Shader]"
+    menupath = item['menupath'].replace("&", "")
+    menu, _, name = menupath.rpartition("/")
+    uiname = "%s [%s]" % (name, menu)
+    full = uiname.lower()
+    name = full.rpartition(" [")[0]
+
+    e = CatalogEntry()
+    e.id = id
+    e.menupath = item['menupath']
+    e.menuobj = item['menuobj']
+    e.root = item.get('menuroot')
+    e.names = tuple(item.get('menunames', ()))
+    e.cleanpath = menupath
+    e.text = uiname
+    e.full = full
+    e.name = name
+    e.menu = menu.lower()
+    e.full_mask = char_mask(full)
+    e.name_mask = char_mask(name)
+    return e
+
+
+def build_index(items, start = 0):
+    """Builds the search index for a list of items from find_menu_items
+    (or CatalogEntry's, like those from MenuTree). start is the id of
+    the first entry, when building part of an index
+    """
+    return [index_entry(item, id = start + n) for n, item in enumerate(items)]
+
+
+class Matcher(object):
+    """nonconsec_find prepared for a single needle, to search many index
+    entries. Entries missing any of the needle's characters are rejected
+    using their precomputed char_mask, and the rest are searched with
+    str.find instead of copying the haystack into a list
+
+    Gives the same results as nonconsec_find, which is kept as the
+    reference implementation:
+
+    >>> from data_test import menu_items
+    >>> entries = build_index([{'menupath': p, 'menuobj': None} for p in menu_items])
+    >>> needles = ["", "b", "blr", "ax[3", "[f", " ma", " gr", " ", " blur [filter]", "a b", "zz"]
+    >>> for needle in needles:
+    ...     for anchored in (True, False):
+    ...         m = Matcher(needle, anchored = anchored)
+    ...         for e in entries:
+    ...             expected = nonconsec_find(needle, e.full, anchored = anchored)
+    ...             assert m(e) == expected, (needle, anchored, e.text)
+    """
 
-        if not self._successful_load:
-            # Avoid clobbering existing weights file on load error
-            print "Not writing weights file because %r previously failed to load" % (
-                self.fname)
-            return
+    def __init__(self, needle, anchored = False):
+        self.needle = needle
+        self.anchored = anchored
 
-        def _save_internal():
-            import json
-            ndir = os.path.dirname(self.fname)
-            if not os.path.isdir(ndir):
-                try:
-                    os.makedirs(ndir)
-                except OSError, e:
-                    if e.errno != 17: # errno 17 is "already exists"
-                        raise
-
-            f = open(self.fname, "w")
-            # TODO: Limit number of saved items to some sane number
-            json.dump(self._weights, fp = f)
-            f.close()
+        # Search "Name [Menu/Path]" if needle contains "[", otherwise
+        # only "Name"
+        self.menu = "[" in needle
 
-        # Catch any errors, print traceback and continue
-        try:
-            _save_internal()
-        except Exception:
-            print "Error saving node weights"
-            import traceback
-            traceback.print_exc()
+        # "[space]abc" also does a consecutive search for "abc"
+        self.spaced = needle.startswith(" ")
+        self.stripped = needle.lstrip(" ")
 
-    def get(self, k, default = 0):
-        if len(self._weights.values()) == 0:
-            maxval = 1.0
+        # Any match contains every character of the stripped needle
+        self.mask = char_mask(self.stripped)
+
+        # Remainder of the needle to search for non-consecutively
+        if anchored:
+            self.rest = needle[1:]
         else:
-            maxval = max(self._weights.values())
-            maxval = max(1, maxval)
-            maxval = float(maxval)
+            self.rest = needle
 
-        return self._weights.get(k, default) / maxval
+    def __call__(self, entry):
+        if self.menu:
+            return self.find(entry.full, entry.full_mask)
+        else:
+            return self.find(entry.name, entry.name_mask)
 
-    def increment(self, key):
-        self._weights.setdefault(key, 0)
-        self._weights[key] += 1
+    def find(self, haystack, haystack_mask):
+        """Checks if the needle is in haystack, where haystack_mask is
+        char_mask(haystack)
+        """
+        needle = self.needle
 
+        if len(needle) == 0:
+            return True
 
-class NodeModel(QtCore.QAbstractListModel):
-    def __init__(self, mlist, weights, num_items = 15, filtertext = ""):
-        super(NodeModel, self).__init__()
+        if len(haystack) == 0:
+            return False
 
-        self.weights = weights
-        self.num_items = num_items
+        if haystack_mask & self.mask != self.mask:
+            return False
 
-        self._all = mlist
-        self._filtertext = filtertext
+        if self.spaced:
+            if self.anchored:
+                if haystack.startswith(self.stripped):
+                    return True
+            elif self.stripped in haystack:
+                return True
 
-        # _items is the list of objects to be shown, update sets this
-        self._items = []
-        self.update()
+        if self.anchored:
+            if needle[0] != haystack[0]:
+                return False
+            pos = 1
+        else:
+            pos = 0
 
-    def set_filter(self, filtertext):
-        self._filtertext = filtertext
-        self.update()
+        find = haystack.find
+        for needle_atom in self.rest:
+            pos = find(needle_atom, pos)
+            if pos == -1:
+                return False
+            # Dont find string in same pos or backwards again
+            pos += 1
+        return True
 
-    def update(self):
-        filtertext = self._filtertext.lower()
+    def end(self, haystack):
+        """Returns the position in haystack just after where find()
+        matches the needle, or -1 if it does not match
 
-        # Two spaces as a shortcut for [
-        filtertext = filtertext.replace("  ", "[")
+        >>> Matcher("bl", anchored = True).end("blur")
+        2
+        >>> Matcher("mrg", anchored = True).end("merge")
+        4
+        """
+        needle = self.needle
 
-        scored = []
-        for n in self._all:
-            # Turn "3D/Shader/Phong" into "Phong [3D/Shader]"
-            menupath = n['menupath'].replace("&", "")
-            uiname = "%s [%s]" % (menupath.rpartition("/")[2], menupath.rpartition("/")[0])
+        if len(needle) == 0:
+            return 0
 
-            if nonconsec_find(filtertext, uiname.lower(), anchored=True):
-                # Matches, get weighting and add to list of stuff
-                score = self.weights.get(n['menupath'])
+        if self.spaced:
+            if self.anchored:
+                if haystack.startswith(self.stripped):
+                    return len(self.stripped)
+            else:
+                pos = haystack.find(self.stripped)
+                if pos != -1:
+                    return pos + len(self.stripped)
+
+        if self.anchored:
+            if len(haystack) == 0 or needle[0] != haystack[0]:
+                return -1
+            pos = 1
+        else:
+            pos = 0
+
+        find = haystack.find
+        for needle_atom in self.rest:
+            pos = find(needle_atom, pos)
+            if pos == -1:
+                return -1
+            pos += 1
+        return pos
+
+
+def likely_next_chars(filtertext, entries, scores, count):
+    """Guesses the count characters most likely to be typed after
+    filtertext, from the character following the match in each of the
+    index entries, weighted by their scores
+
+    >>> entries = build_index([{'menupath': p, 'menuobj': None}
+    ...                        for p in ("Filter/Blur", "Filter/Bilateral", "Color/Grade")])
+    >>> likely_next_chars("b", entries, [1.0, 0.0, 0.0], 2)
+    ['l', 'i']
+    """
+    matcher = Matcher(filtertext, anchored = True)
 
-                scored.append({
-                        'text': uiname,
-                        'menupath': n['menupath'],
-                        'menuobj': n['menuobj'],
-                        'score': score})
+    votes = {}
+    for entry, score in zip(entries, scores):
+        if matcher.menu:
+            haystack = entry.full
+        else:
+            haystack = entry.name
 
-        # Store based on scores (descending), then alphabetically
-        s = sorted(scored, key = lambda k: (-k['score'], k['text']))
+        end = matcher.end(haystack)
+        if 0 <= end < len(haystack):
+            char = haystack[end]
+            votes[char] = votes.get(char, 0) + 1 + score
 
-        self._items = s
-        self.modelReset.emit()
+    return sorted(votes, key = lambda c: (-votes[c], c))[:count]
 
-    def rowCount(self, parent = QtCore.QModelIndex()):
-        return min(self.num_items, len(self._items))
 
-    def data(self, index, role = Qt.DisplayRole):
-        if role == Qt.DisplayRole:
-            # Return text to display
-            raw = self._items[index.row()]['text']
-            return raw
+class PathIndex(object):
+    """Finds which entries of an index from build_index can match an
+    anchored filter text (as NodeModel searches), without testing every
+    entry:
 
-        elif role == Qt.DecorationRole:
-            weight = self._items[index.row()]['score']
+    - With "[", the text after it must be found in order in the menu
+      path, so each distinct menu is only checked once
+    - With a leading space, only names starting with the rest of the
+      text match, which are found by bisecting the sorted names
 
-            hue = 0.4
-            sat = weight
+    Entries with a "[" in their name, or starting with a space, are
+    always included
 
-            if index.row() % 2 == 0:
-                col = QtGui.QColor.fromHsvF(hue, sat, 0.9)
-            else:
-                col = QtGui.QColor.fromHsvF(hue, sat, 0.8)
+    >>> from data_test import menu_items
+    >>> entries = build_index([{'menupath': p, 'menuobj': None} for p in menu_items])
+    >>> paths = PathIndex(entries)
+    >>> len(paths.candidates("ax[3d")) < len(entries)
+    True
+    >>> [entries[i].text for i in paths.candidates(" scen")]
+    ['Scene [3D]']
+    >>> for needle in ("ax[3d", "[f", "a[b[c", "b[filter]", " ma", " grade [color]", " ", "zz", "t"):
+    ...     ids = paths.candidates(needle)
+    ...     if ids is not None:
+    ...         found = find_matches(needle, [entries[i] for i in ids])
+    ...         assert found == find_matches(needle, entries), needle
+    """
 
-            pix = QtGui.QPixmap(6, 12)
-            pix.fill(col)
-            return pix
+    def __init__(self, index):
+        self.index = index
 
-        elif role == Qt.BackgroundRole:
-            return
-            weight = self._items[index.row()]['score']
+        # Ids of the entries in each menu, keyed by the part of their
+        # "full" string after the "["
+        self.menus = {}
+        self.others = []
+        for e in index:
+            if "[" in e.name or e.full.startswith(" "):
+                self.others.append(e.id)
+            else:
+                self.menus.setdefault(e.menu + "]", []).append(e.id)
 
-            hue = 0.4
-            sat = weight ** 2 # gamma saturation to make faster falloff
+        # (sorted strings, ids), built on the first space-prefixed search
+        self._sorted = {}
 
-            sat = min(1.0, sat)
+    def add(self, index, entries):
+        """Adds entries, which have been added to the end of index
+        """
+        self.index = index
+        for e in entries:
+            if "[" in e.name or e.full.startswith(" "):
+                self.others.append(e.id)
+            else:
+                self.menus.setdefault(e.menu + "]", []).append(e.id)
 
-            if index.row() % 2 == 0:
-                return QtGui.QColor.fromHsvF(hue, sat, 0.9)
+            for attr, (keys, ids) in self._sorted.items():
+                key = getattr(e, attr)
+                pos = bisect.bisect_right(keys, key)
+                keys.insert(pos, key)
+                ids.insert(pos, e.id)
+
+    def candidates(self, filtertext):
+        """Returns the sorted ids of the entries which can match
+        filtertext, or None if they cannot be narrowed down
+        """
+        if filtertext.startswith(" "):
+            prefix = filtertext.lstrip(" ")
+            if prefix == "":
+                return None
+            if "[" in prefix:
+                found = self._prefixed("full", prefix)
             else:
-                return QtGui.QColor.fromHsvF(hue, sat, 0.8)
+                found = self._prefixed("name", prefix)
+
+        elif "[" in filtertext:
+            scope = filtertext.partition("[")[2]
+            if scope == "":
+                return None
+            found = []
+            for menu, ids in self.menus.items():
+                if _in_order(scope, menu):
+                    found.extend(ids)
+
         else:
-            # Ignore other roles
             return None
 
-    def getorig(self, selected):
-        # TODO: Is there a way to get this via data()? There's no
-        # Qt.DataRole or something (only DisplayRole)
+        return sorted(found + self.others)
 
-        if len(selected) > 0:
-            # Get first selected index
-            selected = selected[0]
-
-        else:
-            # Nothing selected, get first index
-            selected = self.index(0)
+    def _prefixed(self, attr, prefix):
+        """Ids of the entries whose attr starts with prefix
+        """
+        if attr not in self._sorted:
+            keys = [getattr(e, attr) for e in self.index]
+            ids = sorted(range(len(keys)), key = keys.__getitem__)
+            self._sorted[attr] = ([keys[i] for i in ids], ids)
+        keys, ids = self._sorted[attr]
 
-        # TODO: Maybe check for IndexError?
-        selected_data = self._items[selected.row()]
-        return selected_data
+        start = end = bisect.bisect_left(keys, prefix)
+        while end < len(keys) and keys[end].startswith(prefix):
+            end += 1
+        return ids[start:end]
 
 
-class TabyLineEdit(QtWidgets.QLineEdit):
-    pressed_arrow = QtCore.Signal(str)
-    cancelled = QtCore.Signal()
+def _in_order(needle, haystack):
+    """Checks if the characters of needle are all in haystack, in order
+    """
+    pos = 0
+    find = haystack.find
+    for c in needle:
+        pos = find(c, pos)
+        if pos == -1:
+            return False
+        pos += 1
+    return True
 
 
-    def event(self, event):
-        """Make tab trigger returnPressed
+def is_narrowing(old, new):
+    """Checks if every item matching the search "new" must also match
+    "old", meaning the results for "old" can be filtered further instead
+    of searching everything again
 
-        Also emit signals for the up/down arrows, and escape.
-        """
+    >>> is_narrowing("tr", "tra")
+    True
+    >>> is_narrowing("tra", "tr")
+    False
 
-        is_keypress = event.type() == QtCore.QEvent.KeyPress
+    Adding a "[" switches to matching the menu path, and a leading space
+    disables non-consecutive matching, so neither can be narrowed:
 
-        if is_keypress and event.key() == QtCore.Qt.Key_Tab:
-            # Can't access tab key in keyPressedEvent
-            self.returnPressed.emit()
-            return True
+    >>> is_narrowing("ax", "ax[3")
+    False
+    >>> is_narrowing("", " ma")
+    False
+    >>> is_narrowing(" m", " ma")
+    True
+    """
 
-        elif is_keypress and event.key() == QtCore.Qt.Key_Up:
-            # These could be done in keyPressedEvent, but.. this is already here
-            self.pressed_arrow.emit("up")
-            return True
+    if not new.startswith(old):
+        return False
 
-        elif is_keypress and event.key() == QtCore.Qt.Key_Down:
-            self.pressed_arrow.emit("down")
-            return True
+    if ("[" in old) != ("[" in new):
+        return False
 
-        elif is_keypress and event.key() == QtCore.Qt.Key_Escape:
-            self.cancelled.emit()
-            return True
+    if old.startswith(" ") != new.startswith(" "):
+        return False
 
-        else:
-            return super(TabyLineEdit, self).event(event)
+    return True
 
 
-class TabTabTabWidget(QtWidgets.QDialog):
-    def __init__(self, on_create = None, parent = None, winflags = None):
-        super(TabTabTabWidget, self).__init__(parent = parent)
-        if winflags is not None:
-            self.setWindowFlags(winflags)
+def normalise_filter(filtertext):
+    """Returns filtertext as searched for, in lower case and with two
+    spaces as a shortcut for "["
 
-        self.setMinimumSize(200, 300)
-        self.setMaximumSize(200, 300)
+    >>> normalise_filter("Ax  3D")
+    'ax[3d'
+    """
+    return filtertext.lower().replace("  ", "[")
 
-        # Store callback
-        self.cb_on_create = on_create
 
-        # Input box
-        self.input = TabyLineEdit()
+def make_parent_dir(fname):
+    """Creates the directory fname is in, if it does not exist
+    """
+    ndir = os.path.dirname(fname)
+    if ndir != "" and not os.path.isdir(ndir):
+        try:
+            os.makedirs(ndir)
+        except OSError, e:
+            if e.errno != 17: # errno 17 is "already exists"
+                raise
 
-        # Node weighting
-        self.weights = NodeWeights(os.path.expanduser("~/.nuke/tabtabtab_weights.json"))
-        self.weights.load() # weights.save() called in close method
 
-        import nuke
-        nodes = find_menu_items(nuke.menu("Nodes")) + find_menu_items(nuke.menu("Nuke"))
+def write_json(fname, data):
+    """Writes data to fname as JSON. It is written to a temporary file
+    which is renamed over fname, so a crash can't leave a half written
+    file, and other Nuke instances never read one
+    """
+    import json
 
-        # List of stuff, and associated model
-        self.things_model = NodeModel(nodes, weights = self.weights)
-        self.things = QtWidgets.QListView()
-        self.things.setModel(self.things_model)
+    make_parent_dir(fname)
 
-        # Add input and items to layout
-        layout = QtWidgets.QVBoxLayout()
-        layout.addWidget(self.input)
-        layout.addWidget(self.things)
+    tmpname = "%s.%d.%d.tmp" % (fname, os.getpid(), threading.current_thread().ident)
+    f = open(tmpname, "w")
+    json.dump(data, fp = f)
+    f.close()
 
-        # Remove margins
-        layout.setContentsMargins(0, 0, 0, 0)
-        self.setLayout(layout)
+    if os.name == "nt" and os.path.isfile(fname):
+        # Windows can't rename over an existing file
+        os.remove(fname)
+    os.rename(tmpname, fname)
 
-        # Update on text change
-        self.input.textChanged.connect(self.update)
 
-        # Reset selection on text change
-        self.input.textChanged.connect(lambda: self.move_selection(where="first"))
-        self.move_selection(where = "first") # Set initial selection
+def file_identity(fname):
+    """Returns a value which changes when the file is modified or
+    replaced, or None if it does not exist
+    """
+    try:
+        st = os.stat(fname)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime)
 
-        # Create node when enter/tab is pressed, or item is clicked
-        self.input.returnPressed.connect(self.create)
-        self.things.clicked.connect(self.create)
 
-        # When esc pressed, close
-        self.input.cancelled.connect(self.close)
+class NodeWeights(object):
+    """How often each menu item has been used, saved to the JSON file
+    fname.
+
+    If capacity is set, only that many weights are kept, removing the
+    lowest when saving (except for ones incremented since the last
+    save). If halflife is set, weights halve every halflife days, so
+    items which are no longer used slowly drop off
+
+    >>> import tempfile, shutil
+    >>> tmp = tempfile.mkdtemp()
+    >>> w = NodeWeights(os.path.join(tmp, "weights.json"), capacity = 2)
+    >>> w.load()
+    Weight file does not exist
+    >>> for k in ["Filter/Blur", "Merge/Merge", "Merge/Merge", "3D/Axis", "3D/Axis"]:
+    ...     w.increment(k)
+    >>> w.save()
+    >>> sorted(w._weights.keys())
+    ['3D/Axis', 'Merge/Merge']
+    >>> shutil.rmtree(tmp)
+    """
 
-        # Up and down arrow handling
-        self.input.pressed_arrow.connect(self.move_selection)
+    def __init__(self, fname = None, capacity = None, halflife = None):
+        self.fname = fname
+        self.capacity = capacity
+        self.halflife = halflife
+        self._weights = {}
+        self._successful_load = False
 
-    def under_cursor(self):
-        def clamp(val, mi, ma):
-            return max(min(val, ma), mi)
+        # Time the weights were last aged by halflife. Weights loaded
+        # from the file were aged when it was written
+        self._decayed_at = None
 
-        # Get cursor position, and screen dimensions on active screen
-        cursor = QtGui.QCursor().pos()
-        screen = QtWidgets.QDesktopWidget().screenGeometry(cursor)
+        # file_identity of the weights file when last loaded or saved,
+        # so load() can skip reading it again if it hasn't changed
+        self._identity = None
 
-        # Get window position so cursor is just over text input
-        xpos = cursor.x() - (self.width()/2)
-        ypos = cursor.y() - 13
+        # Increments since the last save, which are kept when loading
+        # changes saved by other Nuke instances
+        self._pending = {}
 
-        # Clamp window location to prevent it going offscreen
-        xpos = clamp(xpos, screen.left(), screen.right() - self.width())
-        ypos = clamp(ypos, screen.top(), screen.bottom() - (self.height()-13))
+        # Held while changing weights, as they can be saved from the
+        # WeightsWriter thread
+        self._lock = threading.Lock()
 
-        # Move window
-        self.move(xpos, ypos)
+        # Held while writing, so a save() and a write on the
+        # WeightsWriter thread can't both use the temporary file
+        self._write_lock = threading.Lock()
 
-    def move_selection(self, where):
-        if where not in ["first", "up", "down"]:
-            raise ValueError("where should be either 'first', 'up', 'down', not %r" % (
-                    where))
+        # Largest weight, kept up to date so get() doesn't need to
+        # search every weight to normalise the value
+        self._maxval = 1.0
 
-        first = where == "first"
-        up = where == "up"
-        down = where == "down"
+        # Increased whenever any weight changes, so results ranked using
+        # the weights can be cached
+        self.generation = 0
 
-        if first:
-            self.things.setCurrentIndex(self.things_model.index(0))
+    def load(self):
+        """Loads the weights file, if it changed since it was last
+        loaded or saved. Increments which have not been saved yet are
+        added to the loaded weights
+
+        >>> import tempfile, shutil
+        >>> tmp = tempfile.mkdtemp()
+        >>> a = NodeWeights(os.path.join(tmp, "weights.json"))
+        >>> b = NodeWeights(os.path.join(tmp, "weights.json"))
+        >>> a.load(); b.load()
+        Weight file does not exist
+        Weight file does not exist
+        >>> a.increment("Filter/Blur"); a.increment("Merge/Merge"); a.save()
+        >>> b.increment("Filter/Blur")
+        >>> b.load()
+        >>> sorted(b._weights.items())
+        [(u'Filter/Blur', 2), (u'Merge/Merge', 1)]
+
+        The file is only read again once it has changed
+
+        >>> weights = b._weights
+        >>> b.load()
+        >>> b._weights is weights
+        True
+        >>> shutil.rmtree(tmp)
+        """
+        if self.fname is None:
             return
 
-        cur = self.things.currentIndex()
-        if up:
-            new = cur.row() - 1
-            if new < 0:
-                new = self.things_model.rowCount() - 1
-        elif down:
-            new = cur.row() + 1
-            count = self.things_model.rowCount()
-            if new > count-1:
-                new = 0
+        def _load_internal():
+            if not os.path.isfile(self.fname):
+                print "Weight file does not exist"
+                return
 
-        self.things.setCurrentIndex(self.things_model.index(new))
+            with timings.timed("weights_load"):
+                with self._lock:
+                    self._merge_file()
 
-    def event(self, event):
-        """Close when window becomes inactive (click outside of window)
+        # Catch any errors, print traceback and continue
+        try:
+            _load_internal()
+            self._successful_load = True
+        except Exception:
+            print "Error loading node weights"
+            import traceback
+            traceback.print_exc()
+            self._successful_load = False
+
+    def _merge_file(self):
+        """Reads the weights file if it changed since last loaded or
+        saved, keeping unsaved increments. Must hold self._lock
         """
-        if event.type() == QtCore.QEvent.WindowDeactivate:
-            self.close()
-            return True
+        import json
+
+        identity = file_identity(self.fname)
+        if identity is not None and identity == self._identity:
+            # Unchanged since last load or save
+            return
+
+        f = open(self.fname)
+        weights = json.load(f)
+        f.close()
+
+        for k, v in self._pending.items():
+            weights[k] = weights.get(k, 0) + v
+
+        self._weights = weights
+        self._identity = identity
+        if identity is not None:
+            self._decayed_at = identity[3]
+        self._weights_changed()
+        self._evict()
+
+    def _age(self, now):
+        """Decays the weights by the time since they were last aged.
+        Must hold self._lock
+        """
+        if self.halflife is None:
+            return
+
+        if self._decayed_at is None:
+            self._decayed_at = now
+            return
+
+        elapsed = now - self._decayed_at
+        if elapsed <= 0:
+            return
+
+        # Increments since the last save are recent, so only decay
+        # the rest of the weight
+        factor = 0.5 ** (elapsed / (self.halflife * 24 * 60 * 60.0))
+        pending = self._pending
+        self._weights = dict(
+            (k, round((v - pending.get(k, 0)) * factor + pending.get(k, 0), 4))
+            for k, v in self._weights.items())
+        self._decayed_at = now
+        self._weights_changed()
+
+    def _evict(self):
+        """Removes the lowest weights, keeping at most capacity. Items
+        incremented since the last save are kept first. Must hold
+        self._lock
+        """
+        if self.capacity is None or len(self._weights) <= self.capacity:
+            return
+
+        pending = self._pending
+        keep = heapq.nlargest(
+            self.capacity, self._weights.items(),
+            key = lambda kv: (kv[0] in pending, kv[1]))
+
+        self._weights = dict(keep)
+        self._weights_changed()
+
+    def _can_save(self):
+        if self.fname is None:
+            print "Not saving node weights, no file specified"
+            return False
+
+        if not self._successful_load:
+            # Avoid clobbering existing weights file on load error
+            print "Not writing weights file because %r previously failed to load" % (
+                self.fname)
+            return False
+
+        return True
+
+    def save(self):
+        """Writes the weights file, after merging in any changes saved
+        by other Nuke instances
+        """
+        if not self._can_save():
+            return
+
+        # Catch any errors, print traceback and continue
+        try:
+            self._write()
+        except Exception:
+            print "Error saving node weights"
+            import traceback
+            traceback.print_exc()
+
+    def save_async(self):
+        """Same as save, but writes the file on a background thread.
+        Multiple calls before the write happens result in one write.
+        flush_weights() waits for the write to finish
+
+        >>> import tempfile, shutil, json, StringIO
+        >>> tmp = tempfile.mkdtemp()
+        >>> w = NodeWeights(os.path.join(tmp, "weights.json"))
+        >>> w.load()
+        Weight file does not exist
+        >>> w.increment("Filter/Blur"); w.save_async()
+        >>> w.increment("Filter/Blur"); w.save_async()
+        >>> flush_weights()
+        >>> json.load(open(w.fname)), w._pending
+        ({u'Filter/Blur': 2}, {})
+
+        If the write fails, the increments are kept for the next save
+
+        >>> w.fname = os.path.join(w.fname, "weights.json")
+        >>> w.increment("Merge/Merge")
+        >>> stderr, sys.stderr = sys.stderr, StringIO.StringIO()
+        >>> w.save_async(); flush_weights()
+        Error saving node weights
+        >>> sys.stderr = stderr
+        >>> w._pending
+        {'Merge/Merge': 1}
+        >>> shutil.rmtree(tmp)
+        """
+        if not self._can_save():
+            return
+
+        weights_writer().schedule(self)
+
+    def _write(self):
+        with self._write_lock:
+            with timings.timed("weights_save"):
+                self._write_internal()
+
+    def _write_internal(self):
+        with self._lock:
+            if os.path.isfile(self.fname):
+                try:
+                    self._merge_file()
+                except Exception:
+                    self._successful_load = False
+                    raise
+
+            self._age(time.time())
+            self._evict()
+
+            weights = dict(self._weights)
+            pending = self._pending
+            self._pending = {}
+
+        try:
+            write_json(self.fname, weights)
+        except Exception:
+            # Keep unsaved increments for the next save
+            with self._lock:
+                for k, v in pending.items():
+                    self._pending[k] = self._pending.get(k, 0) + v
+            raise
+
+        with self._lock:
+            self._identity = file_identity(self.fname)
+
+    def _weights_changed(self):
+        """Updates the maximum and generation after the weights were
+        replaced
+        """
+        self.generation += 1
+        if len(self._weights) == 0:
+            self._maxval = 1.0
         else:
-            return super(TabTabTabWidget, self).event(event)
+            self._maxval = float(max(1, max(self._weights.values())))
+
+    def get(self, k, default = 0):
+        """Weight for k, normalised to between 0 and 1
+        """
+        return self._weights.get(k, default) / self._maxval
+
+    def get_many(self, keys, default = 0):
+        """Normalised weights for each of the given keys, in order
+
+        >>> w = NodeWeights()
+        >>> w.increment("Filter/Blur")
+        >>> w.increment("Filter/Blur")
+        >>> w.increment("Merge/Merge")
+        >>> w.get_many(["Filter/Blur", "Merge/Merge", "3D/Axis"])
+        [1.0, 0.5, 0.0]
+        """
+        weights = self._weights
+        maxval = self._maxval
+        return [weights.get(k, default) / maxval for k in keys]
+
+    def snapshot(self):
+        """Returns a copy of the current weights, which can be read from
+        another thread while these change
+        """
+        snapshot = NodeWeights()
+        with self._lock:
+            snapshot._weights = dict(self._weights)
+            snapshot._maxval = self._maxval
+            snapshot.generation = self.generation
+        return snapshot
+
+    def _add(self, key, amount):
+        self.generation += 1
+        self._weights.setdefault(key, 0)
+        self._weights[key] += amount
+
+        if self._weights[key] > self._maxval:
+            self._maxval = float(self._weights[key])
+
+    def increment(self, key):
+        with self._lock:
+            self._add(key, 1)
+
+            self._pending.setdefault(key, 0)
+            self._pending[key] += 1
+
+
+class WeightsWriter(object):
+    """Calls NodeWeights._write on a background thread, so saving never
+    blocks the UI. Saves scheduled while an earlier one is still
+    waiting are combined into a single write
+
+    >>> writes = []
+    >>> class CountedWeights(NodeWeights):
+    ...     def _write(self):
+    ...         writes.append(self)
+    >>> w = CountedWeights()
+    >>> writer = WeightsWriter()
+    >>> with writer._cond: # Keeps the thread waiting until both are scheduled
+    ...     writer.schedule(w)
+    ...     writer.schedule(w)
+    >>> writer.wait(); writer.stop()
+    >>> len(writes)
+    1
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._queued = []
+        self._busy = False
+        self._stopping = False
+        self._thread = None
+
+    def schedule(self, weights):
+        with self._cond:
+            stopping = self._stopping
+
+            if not stopping:
+                if weights not in self._queued:
+                    self._queued.append(weights)
+
+                if self._thread is None:
+                    self._thread = threading.Thread(target = self._run, name = "tabtabtab weights writer")
+                    self._thread.daemon = True
+                    self._thread.start()
+
+                self._cond.notify_all()
+
+        if stopping:
+            # Exiting, write straight away
+            weights.save()
 
-    def update(self, text):
-        """On text change, selects first item and updates filter text
+    def wait(self):
+        """Blocks until all scheduled writes are finished
         """
-        self.things.setCurrentIndex(self.things_model.index(0))
-        self.things_model.set_filter(text)
+        with self._cond:
+            while len(self._queued) > 0 or self._busy:
+                self._cond.wait()
 
-    def show(self):
-        """Select all the text in the input (which persists between
-        show()'s)
+    def stop(self):
+        """Writes anything scheduled, and ends the thread
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            thread = self._thread
+
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while len(self._queued) == 0 and not self._stopping:
+                    self._cond.wait()
+                if len(self._queued) == 0:
+                    return
+                weights = self._queued.pop(0)
+                self._busy = True
+
+            try:
+                weights._write()
+            except Exception:
+                print "Error saving node weights"
+                import traceback
+                traceback.print_exc()
+
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+
+_weights_writer = None
+
+def weights_writer():
+    """Returns the WeightsWriter, creating it on first use
+    """
+    global _weights_writer
+    if _weights_writer is None:
+        _weights_writer = WeightsWriter()
+
+        # Don't lose scheduled writes when Nuke exits, and end the
+        # thread before the interpreter is torn down
+        import atexit
+        atexit.register(_weights_writer.stop)
+    return _weights_writer
+
+
+def flush_weights():
+    """Waits for weights scheduled with NodeWeights.save_async to be
+    written
+    """
+    if _weights_writer is not None:
+        _weights_writer.wait()
+
+
+class SQLiteNodeWeights(NodeWeights):
+    """NodeWeights stored in an SQLite database, which any number of Nuke
+    instances can update at once. Like NodeWeights, increments are kept
+    in memory until save() or save_async(), which adds them to the
+    database in a single transaction.
+
+    The weights in import_fname (a NodeWeights JSON file) are copied
+    into the database the first time it is used, on the WeightsWriter
+    thread. Until then load() reads them from the JSON file
+
+    >>> import tempfile, shutil
+    >>> tmp = tempfile.mkdtemp()
+    >>> a = SQLiteNodeWeights(os.path.join(tmp, "weights.sqlite"))
+    >>> b = SQLiteNodeWeights(os.path.join(tmp, "weights.sqlite"))
+    >>> a.increment("Filter/Blur")
+    >>> b.increment("Filter/Blur")
+    >>> b.increment("Merge/Merge")
+    >>> a.save(); b.save()
+    >>> a.load()
+    >>> a.get_many(["Filter/Blur", "Merge/Merge"])
+    [1.0, 0.5]
+    >>> b.top(1)
+    [(u'Filter/Blur', 2.0)]
+    >>> a.close(); b.close(); shutil.rmtree(tmp)
+    """
 
-        Allows typing over previously created text, and [tab][tab] to
-        create previously created node (instead of the most popular)
+    def __init__(self, fname = None, import_fname = None, capacity = None, halflife = None):
+        super(SQLiteNodeWeights, self).__init__(
+            fname = fname, capacity = capacity, halflife = halflife)
+        self.import_fname = import_fname
+        self._db = None
+
+        # Separate connection for writes, which can happen on the
+        # WeightsWriter thread. Only used while holding _write_lock
+        self._write_db = None
+
+        # When the capacity and halflife were last applied to the table
+        self._maintained_at = None
+
+        # PRAGMA data_version when last loaded, which changes when
+        # other connections modify the database
+        self._data_version = None
+
+    def _connect(self):
+        if self._db is not None:
+            return self._db
+
+        self._db = self._open()
+        return self._db
+
+    def _open(self, check_same_thread = True):
+        import sqlite3
+
+        make_parent_dir(self.fname)
+
+        # isolation_level None means transactions are started explicitly
+        db = sqlite3.connect(
+            self.fname, timeout = 10, isolation_level = None,
+            check_same_thread = check_same_thread)
+        db.execute("PRAGMA journal_mode = WAL")
+        db.execute("PRAGMA synchronous = NORMAL")
+        db.execute("CREATE TABLE IF NOT EXISTS weights (key TEXT PRIMARY KEY, count REAL NOT NULL)")
+        db.execute("CREATE INDEX IF NOT EXISTS weights_count ON weights (count)")
+        db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value REAL)")
+        return db
+
+    def _imported(self, db):
+        """True if the import_fname weights were copied into the
+        database already (recorded in its user_version)
         """
+        return db.execute("PRAGMA user_version").fetchone()[0] != 0
 
-        # Load the weights everytime the panel is shown, to prevent
-        # overwritting weights from other Nuke instances
-        self.weights.load()
+    def _read_import(self):
+        """Returns the weights in import_fname, or {} if there are none
+        """
+        if self.import_fname is None or not os.path.isfile(self.import_fname):
+            return {}
+
+        import json
+        f = open(self.import_fname)
+        weights = json.load(f)
+        f.close()
+        return weights
+
+    def _import_json(self, db):
+        """Copies weights from import_fname, unless they were imported
+        already. Only takes the write lock when they weren't
+        """
+        if self._imported(db):
+            return
 
-        # Select all text to allow overwriting
-        self.input.selectAll()
-        self.input.setFocus()
+        weights = self._read_import()
 
-        super(TabTabTabWidget, self).show()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            # Another instance may have imported them meanwhile
+            if not self._imported(db):
+                db.executemany(
+                    "INSERT OR IGNORE INTO weights (key, count) VALUES (?, ?)",
+                    weights.items())
+                db.execute("PRAGMA user_version = 1")
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
 
     def close(self):
-        """Save weights when closing
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+        with self._write_lock:
+            if self._write_db is not None:
+                self._write_db.close()
+                self._write_db = None
+
+    def load(self):
+        """Loads all weights from the database, if another connection
+        has changed it since the last load
+        """
+        if self.fname is None:
+            return
+
+        try:
+            db = self._connect()
+
+            version = db.execute("PRAGMA data_version").fetchone()
+            if version is not None and version[0] == self._data_version:
+                return
+
+            weights = dict(db.execute("SELECT key, count FROM weights"))
+
+            if not self._imported(db):
+                # Use the JSON weights until the WeightsWriter has
+                # copied them into the database
+                imported = self._read_import()
+                for k, v in imported.items():
+                    weights.setdefault(k, v)
+                if len(imported) > 0:
+                    weights_writer().schedule(self)
+
+            with self._lock:
+                # Keep increments which aren't written yet
+                for k, v in self._pending.items():
+                    weights[k] = weights.get(k, 0) + v
+                self._weights = weights
+                self._weights_changed()
+            if version is not None:
+                self._data_version = version[0]
+            self._successful_load = True
+        except Exception:
+            print "Error loading node weights"
+            import traceback
+            traceback.print_exc()
+            self._successful_load = False
+
+    def _maintain(self, db, now):
+        """Ages the weights by halflife, and removes the lowest to
+        leave at most capacity. Called by _write_internal inside its
+        transaction
+        """
+        if self.halflife is not None:
+            row = db.execute("SELECT value FROM meta WHERE name = 'decayed_at'").fetchone()
+            if row is not None and now > row[0]:
+                factor = 0.5 ** ((now - row[0]) / (self.halflife * 24 * 60 * 60.0))
+                db.execute("UPDATE weights SET count = count * ?", (factor, ))
+            db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('decayed_at', ?)", (now, ))
+
+        if self.capacity is not None:
+            db.execute(
+                "DELETE FROM weights WHERE key NOT IN"
+                " (SELECT key FROM weights ORDER BY count DESC LIMIT ?)",
+                (self.capacity, ))
+
+    def _can_save(self):
+        # Increments are added to what's in the database, so there is
+        # nothing to clobber if loading failed
+        if self.fname is None:
+            print "Not saving node weights, no file specified"
+            return False
+
+        return True
+
+    def _write_internal(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+
+        # Apply the capacity and halflife at most hourly, as they
+        # change every row
+        now = time.time()
+        maintain = (
+            (self.halflife is not None or self.capacity is not None) and
+            (self._maintained_at is None or now - self._maintained_at > 60 * 60))
+
+        try:
+            if self._write_db is None:
+                self._write_db = self._open(check_same_thread = False)
+
+            db = self._write_db
+            self._import_json(db)
+
+            if len(pending) == 0 and not maintain:
+                return
+
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                if maintain:
+                    # Before adding the increments, which are recent so
+                    # shouldn't be decayed
+                    self._maintain(db, now)
+
+                db.executemany(
+                    "INSERT OR IGNORE INTO weights (key, count) VALUES (?, 0)",
+                    [(k, ) for k in pending])
+                db.executemany(
+                    "UPDATE weights SET count = count + ? WHERE key = ?",
+                    [(v, k) for k, v in pending.items()])
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+
+            if maintain:
+                self._maintained_at = now
+        except Exception:
+            # Keep the increments to try again on the next save
+            with self._lock:
+                for k, v in pending.items():
+                    self._pending[k] = self._pending.get(k, 0) + v
+            raise
+
+    def top(self, count):
+        """Returns the (key, weight) pairs of the count highest weights,
+        straight from the database
+        """
+        db = self._connect()
+        return db.execute(
+            "SELECT key, count FROM weights ORDER BY count DESC LIMIT ?",
+            (count, )).fetchall()
+
+
+# Maximum number of node weights to keep, None to keep them all
+WEIGHTS_CAPACITY = None
+
+# Number of days after which node weights are halved, None to never
+# decay them
+WEIGHTS_HALFLIFE = None
+
+
+def default_weights():
+    """Creates the weights used by TabTabTabWidget, stored in ~/.nuke/
+
+    Setting the TABTABTAB_WEIGHTS environment variable to "sqlite" uses
+    SQLiteNodeWeights, which is safe for many Nuke instances sharing a
+    home directory, instead of the default JSON file
+    """
+    json_fname = os.path.expanduser("~/.nuke/tabtabtab_weights.json")
+
+    if os.environ.get("TABTABTAB_WEIGHTS", "json") == "sqlite":
+        return SQLiteNodeWeights(
+            os.path.expanduser("~/.nuke/tabtabtab_weights.sqlite"),
+            import_fname = json_fname,
+            capacity = WEIGHTS_CAPACITY,
+            halflife = WEIGHTS_HALFLIFE)
+
+    return NodeWeights(json_fname, capacity = WEIGHTS_CAPACITY, halflife = WEIGHTS_HALFLIFE)
+
+
+def find_matches(filtertext, candidates, is_cancelled = None, chunk = 1000):
+    """Returns the index entries in candidates matching filtertext (with
+    "  " already replaced by "["). Stops and returns None if is_cancelled
+    returns True, which is checked after every chunk of entries
+    """
+    matcher = Matcher(filtertext, anchored = True)
+
+    if is_cancelled is None:
+        return [n for n in candidates if matcher(n)]
+
+    matches = []
+    for start in range(0, len(candidates), chunk):
+        if is_cancelled():
+            return None
+        matches.extend(n for n in candidates[start:start + chunk] if matcher(n))
+    return matches
+
+
+def best_scored(matches, scores, count):
+    """Returns the positions in matches of the count best entries,
+    sorted by their score (descending), then alphabetically
+    """
+    return heapq.nsmallest(
+        count, xrange(len(matches)),
+        key = lambda i: (-scores[i], matches[i].text))
+
+
+# Search with NumpyIndex for catalogs of at least this many items, when
+# numpy can be imported. None to always use the pure-Python search
+NUMPY_MIN_ITEMS = 5000
+
+_numpy = None
+
+
+def get_numpy():
+    """Returns the numpy module, or None if it cannot be imported. Only
+    tries importing it the first time
+    """
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            numpy = False
+        _numpy = numpy
+    return _numpy or None
+
+
+def numpy_index(index):
+    """Returns a NumpyIndex for index, or None if the pure-Python search
+    should be used (numpy is unavailable, or index is small)
+    """
+    if NUMPY_MIN_ITEMS is None or len(index) < NUMPY_MIN_ITEMS:
+        return None
+    if get_numpy() is None:
+        return None
+    return NumpyIndex(index)
+
+
+class NumpyIndex(object):
+    """Vectorised search of an index from build_index, for large
+    catalogs. Matches are arrays of entry ids: every entry's char_mask is
+    checked in one pass, and only the survivors are verified with a
+    Matcher. The weights are kept as an array aligned with the index
+
+    Gives the same results as find_matches and best_scored:
+
+    >>> from data_test import menu_items
+    >>> entries = build_index([{'menupath': p, 'menuobj': None} for p in menu_items])
+    >>> w = NodeWeights()
+    >>> for p in menu_items[::7]: w.increment(p)
+    >>> if get_numpy() is not None:
+    ...     ni = NumpyIndex(entries)
+    ...     for needle in ("", "b", "ax", "ax[3d", " sc", "t", "zzz"):
+    ...         matches = find_matches(needle, entries)
+    ...         scores = w.get_many([e.menupath for e in matches])
+    ...         expected = [matches[i].id for i in best_scored(matches, scores, 20)]
+    ...         ids = ni.find(needle)
+    ...         best = ni.best(ids, ni.scores(ids, w), 20)
+    ...         assert [e.id for e in matches] == ids.tolist(), needle
+    ...         assert ids[best].tolist() == expected, needle
+    """
+
+    def __init__(self, index):
+        np = get_numpy()
+        count = len(index)
+
+        self.index = index
+        self.all = np.arange(count)
+        self.full_masks = np.fromiter((e.full_mask for e in index), dtype = np.uint64, count = count)
+        self.name_masks = np.fromiter((e.name_mask for e in index), dtype = np.uint64, count = count)
+
+        # Position of each entry when sorted by text, with ties in index
+        # order, as best_scored sorts them
+        texts = [e.text for e in index]
+        self._order = sorted(range(count), key = texts.__getitem__)
+        self._texts = [texts[i] for i in self._order]
+        self._rank()
+
+        # ((weights generation, number of entries), array) of the
+        # weights of every entry. The number of entries is part of the
+        # key as extend() can run while a FilterWorker job is filling it
+        self._weights = (None, None)
+
+    def _rank(self):
+        np = get_numpy()
+        self.text_rank = np.empty(len(self._order), dtype = np.int64)
+        self.text_rank[self._order] = self.all
+
+    def extend(self, index, entries, weights):
+        """Adds entries, which have been added to the end of index,
+        without rebuilding the arrays for the existing entries
+        """
+        np = get_numpy()
+        count = len(entries)
+
+        self.index = index
+        self.all = np.arange(len(index))
+        self.full_masks = np.concatenate((
+            self.full_masks,
+            np.fromiter((e.full_mask for e in entries), dtype = np.uint64, count = count)))
+        self.name_masks = np.concatenate((
+            self.name_masks,
+            np.fromiter((e.name_mask for e in entries), dtype = np.uint64, count = count)))
+
+        for e in entries:
+            pos = bisect.bisect_right(self._texts, e.text)
+            self._texts.insert(pos, e.text)
+            self._order.insert(pos, e.id)
+        self._rank()
+
+        key, array = self._weights
+        if key == (weights.generation, len(index) - count):
+            added = weights.get_many([e.menupath for e in entries])
+            self._weights = (
+                (weights.generation, len(index)),
+                np.concatenate((array, np.array(added, dtype = float))))
+
+    def find(self, filtertext, candidates = None, is_cancelled = None, chunk = 1000):
+        """Returns the ids of the entries matching filtertext, out of the
+        candidates array of ids (or all of them), like find_matches
+        """
+        np = get_numpy()
+        if candidates is None:
+            candidates = self.all
+        if filtertext == "":
+            return candidates
+
+        matcher = Matcher(filtertext, anchored = True)
+        if matcher.menu:
+            masks = self.full_masks
+        else:
+            masks = self.name_masks
+
+        mask = np.uint64(matcher.mask)
+        survivors = candidates[(masks[candidates] & mask) == mask].tolist()
+
+        index = self.index
+        matched = []
+        for start in range(0, len(survivors), chunk):
+            if is_cancelled is not None and is_cancelled():
+                return None
+            matched.extend(i for i in survivors[start:start + chunk] if matcher(index[i]))
+
+        return np.array(matched, dtype = np.intp)
+
+    def scores(self, ids, weights):
+        """Returns the normalised weights of the entries with the given
+        ids. The weights of the whole index are only looked up again
+        when weights.generation changes
         """
-        self.weights.save()
-        super(TabTabTabWidget, self).close()
+        np = get_numpy()
+        index = self.index
+        key = (weights.generation, len(index))
+        cached, array = self._weights
+        if cached != key:
+            array = np.array(weights.get_many([e.menupath for e in index]), dtype = float)
+            self._weights = (key, array)
+        return array[ids]
+
+    def best(self, ids, scores, count):
+        """Returns the positions in ids of the count best entries,
+        sorted by their score (descending), then alphabetically, like
+        best_scored
+        """
+        np = get_numpy()
+        total = len(ids)
+        if count <= 0 or total == 0:
+            return []
+
+        ranks = self.text_rank[ids]
+        if count < total:
+            # Everything scoring above the count'th best score, and as
+            # many of the entries tied with it as fit, alphabetically
+            kth = scores[np.argpartition(-scores, count - 1)[count - 1]]
+            above = np.flatnonzero(scores > kth)
+            tied = np.flatnonzero(scores == kth)
+            need = count - len(above)
+            if need < len(tied):
+                tied = tied[np.argpartition(ranks[tied], need - 1)[:need]]
+            positions = np.concatenate((above, tied))
+        else:
+            positions = np.arange(total)
+
+        order = np.lexsort((ranks[positions], -scores[positions]))
+        return positions[order].tolist()
+
+
+class ResultCache(object):
+    """Least recently used cache, holding at most max_entries values,
+    and at most max_size in total of the sizes given to put()
+
+    >>> c = ResultCache(max_entries = 2)
+    >>> c.put("a", 1); c.put("b", 2); c.get("a")
+    1
+    >>> c.put("c", 3)
+    >>> c.get("b") is None
+    True
+    """
+
+    def __init__(self, max_entries = 64, max_size = 200000):
+        import collections
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self._entries = collections.OrderedDict()
+        self._size = 0
+
+    def get(self, key):
+        if key not in self._entries:
+            return None
+
+        # Move to the end, as most recently used
+        value, size = self._entries.pop(key)
+        self._entries[key] = (value, size)
+        return value
 
-    def create(self):
-        # Get selected item
-        selected = self.things.selectedIndexes()
-        if len(selected) == 0:
+    def put(self, key, value, size = 1):
+        if key in self._entries:
+            self._size -= self._entries.pop(key)[1]
+
+        if size > self.max_size:
             return
 
-        thing = self.things_model.getorig(selected)
+        self._entries[key] = (value, size)
+        self._size += size
+
+        while len(self._entries) > self.max_entries or self._size > self.max_size:
+            _, (_, oldsize) = self._entries.popitem(last = False)
+            self._size -= oldsize
+
+    def clear(self):
+        self._entries.clear()
+        self._size = 0
+
+
+class FilterWorker(object):
+    """Runs filtering jobs on a background thread. Only the most recent
+    job is run, and submitting a job cancels the one already running
+
+    >>> started, release, done = threading.Event(), threading.Event(), threading.Event()
+    >>> results = []
+    >>> def slow(is_cancelled):
+    ...     started.set()
+    ...     release.wait()
+    ...     if not is_cancelled():
+    ...         return "slow"
+    >>> def finished(result):
+    ...     results.append(result)
+    ...     done.set()
+    >>> worker = FilterWorker()
+    >>> worker.submit(slow, finished)
+    >>> started.wait(10)
+    True
+
+    While it runs, the newer of these jobs replaces the older one,
+    which is never run
+
+    >>> worker.submit(lambda is_cancelled: "older", finished)
+    >>> worker.submit(lambda is_cancelled: "newest", finished)
+    >>> release.set()
+    >>> done.wait(10)
+    True
+    >>> results
+    [(3, 'newest')]
+
+    cancel() stops the running job without calling back
 
-        # Store the full UI name of the created node, so it is the
-        # active node on the next [tab]. Prefix it with space,
-        # to disable substring matching
-        if thing['text'].startswith(" "):
-            prev_string = thing['text']
+    >>> started.clear(); release.clear()
+    >>> worker.submit(slow, finished)
+    >>> started.wait(10)
+    True
+    >>> worker.cancel(); release.set(); worker.stop()
+    >>> results
+    [(3, 'newest')]
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._job = None
+        self._stopping = False
+        self._thread = None
+
+        # Increased for each job, the running job is cancelled when it
+        # no longer matches
+        self.generation = 0
+
+    def submit(self, job, callback):
+        """Runs job(is_cancelled) on the worker thread. Unless it is
+        cancelled, callback((generation, result)) is then called on
+        the worker thread
+        """
+        with self._cond:
+            self.generation += 1
+            self._job = (self.generation, job, callback)
+
+            if self._thread is None:
+                self._thread = threading.Thread(target = self._run, name = "tabtabtab filter")
+                self._thread.daemon = True
+                self._thread.start()
+
+                import atexit
+                atexit.register(self.stop)
+
+            self._cond.notify_all()
+
+    def cancel(self):
+        with self._cond:
+            self.generation += 1
+            self._job = None
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self.generation += 1
+            self._cond.notify_all()
+            thread = self._thread
+
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._job is None and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    return
+                generation, job, callback = self._job
+                self._job = None
+
+            is_cancelled = lambda: self.generation != generation
+
+            try:
+                result = job(is_cancelled)
+            except Exception:
+                print "Error filtering nodes"
+                import traceback
+                traceback.print_exc()
+                continue
+
+            if result is not None and not is_cancelled():
+                callback((generation, result))
+
+
+class SearchResult(object):
+    """A menu item found by SearchEngine.search
+    """
+    __slots__ = ('id', 'text', 'menupath', 'menuobj', 'score')
+
+    def __init__(self, entry, score):
+        self.id = entry.id
+        self.text = entry.text
+        self.menupath = entry.menupath
+        self.menuobj = entry.menuobj
+        self.score = score
+
+    def __repr__(self):
+        return "<SearchResult %s %.2f>" % (self.text, self.score)
+
+
+class Ranking(object):
+    """The index entries matching a filter text and their scores, from
+    rank_candidates. With a NumpyIndex, matches and scores are arrays,
+    and matches holds the ids of the entries
+    """
+
+    def __init__(self, filtertext, matches, scores, index, numpy = None):
+        self.filtertext = filtertext
+        self.matches = matches
+        self.scores = scores
+        self.index = index
+        self.numpy = numpy
+
+        # Key the Ranking is cached with by SearchEngine
+        self.key = None
+
+        # (count, positions) of the best entries ranked so far
+        self._best = (0, [])
+
+    def __len__(self):
+        return len(self.matches)
+
+    def best(self, count):
+        """Returns the positions in matches of the count best entries,
+        sorted by score (descending), then alphabetically
+        """
+        ranked, positions = self._best
+        if count <= ranked:
+            return positions[:count]
+
+        if self.numpy is not None:
+            positions = self.numpy.best(self.matches, self.scores, count)
+        else:
+            positions = best_scored(self.matches, self.scores, count)
+        self._best = (count, positions)
+        return positions
+
+    def ids(self, positions):
+        """Ids of the index entries at the given positions in matches
+        """
+        if self.numpy is not None:
+            return self.matches[positions].tolist()
+        else:
+            return [self.matches[i].id for i in positions]
+
+    def results(self, count):
+        """SearchResults for the count best entries
+        """
+        positions = self.best(count)
+        return [SearchResult(self.index[i], float(self.scores[p]))
+                for i, p in zip(self.ids(positions), positions)]
+
+
+def rank_candidates(filtertext, candidates, exact, weights, index, numpy = None,
+                    count = 0, is_cancelled = None):
+    """Returns the Ranking of the candidates matching filtertext (all of
+    them if exact is True), with the best count of them already sorted.
+    candidates are entries of index, or an array of their ids if numpy
+    is index's NumpyIndex. Returns None if is_cancelled returns True
+    part way through
+    """
+    with timings.timed("match"):
+        if exact:
+            matches = candidates
+        elif numpy is not None:
+            matches = numpy.find(filtertext, candidates, is_cancelled = is_cancelled)
+        else:
+            matches = find_matches(filtertext, candidates, is_cancelled = is_cancelled)
+        if matches is None:
+            return None
+
+    with timings.timed("score"):
+        if numpy is not None:
+            scores = numpy.scores(matches, weights)
+        else:
+            scores = weights.get_many([n.menupath for n in matches])
+
+    ranking = Ranking(filtertext, matches, scores, index, numpy)
+
+    # Only rank as many items as are needed, the rest are ranked later
+    # if more are wanted
+    with timings.timed("sort"):
+        ranking.best(count)
+
+    return ranking
+
+
+class SearchEngine(object):
+    """Searches menu items (as from find_menu_items), ranking the matches
+    by their NodeWeights. Doesn't use Qt, so it can be used from scripts
+    and other threads. NodeModel shows its results in tabtabtab
+
+    >>> from data_test import menu_items
+    >>> weights = NodeWeights()
+    >>> weights.increment("Filter/Blur")
+    >>> engine = SearchEngine([{'menupath': p, 'menuobj': None} for p in menu_items], weights)
+    >>> engine.search("bl", limit = 2)
+    [<SearchResult Blur [Filter] 1.00>, <SearchResult BasicMaterial [3D/Shader] 0.00>]
+    >>> [len(results) for results in engine.search_many(["m", "mr", "mrg", "zzz"], limit = 5)]
+    [5, 5, 4, 0]
+    """
+
+    def __init__(self, items, weights, index = None):
+        self.weights = weights
+
+        # Incremented whenever the items change
+        self.generation = 0
+
+        # Held while using the search history and caches, so searches
+        # can be made from any thread
+        self._lock = threading.RLock()
+
+        # Ranked results of recent searches, keyed by the filter text
+        # and generation of the weights and items they were ranked with
+        self._cache = ResultCache()
+
+        # {cache key: Ranking} of searches for filter texts which might
+        # be typed next, and the total number of their matches
+        self._speculated = {}
+        self._speculated_size = 0
+
+        # [cache key, ranking narrowed, position reached, matches] of a
+        # speculative search which was stopped part way through
+        self._partial = None
+
+        self.set_items(items, index = index)
+
+    def set_items(self, items, index = None):
+        """Replaces the items being searched. index can be given if
+        build_index(items) was already done. Only the index is kept
+        """
+        if index is None:
+            index = build_index(items)
+
+        with self._lock:
+            self.index = index
+            self.numpy = numpy_index(index)
+            self._paths = None
+            self._items_changed()
+
+    def patch_items(self, added, removed):
+        """Adds the items in the list added, and removes the ones with
+        menupaths in removed, only building the index for the new items.
+        Searches give the same results as a new SearchEngine would
+
+        >>> from data_test import menu_items
+        >>> items = [{'menupath': p, 'menuobj': None} for p in menu_items]
+        >>> weights = NodeWeights()
+        >>> for p in menu_items[::7]: weights.increment(p)
+        >>> queries = ["b", "ax", "ax[3d", " sc", "t", "mrg", "zzz"]
+        >>> def same(engine, items):
+        ...     fresh = SearchEngine(items, weights)
+        ...     return all(
+        ...         [r.text for r in engine.search(q, limit = 50)] ==
+        ...         [r.text for r in fresh.search(q, limit = 50)]
+        ...         for q in queries)
+        >>> for use_numpy in (False, get_numpy() is not None):
+        ...     engine = SearchEngine(items[:200], weights)
+        ...     if use_numpy:
+        ...         engine.numpy = NumpyIndex(engine.index)
+        ...     searched = [engine.search(q) for q in queries]
+        ...     engine.patch_items(items[200:], [])
+        ...     assert same(engine, items)
+        ...     removed = [i['menupath'] for i in items[::5]]
+        ...     engine.patch_items([], removed)
+        ...     assert same(engine, [i for i in items if i['menupath'] not in removed])
+        """
+        with self._lock:
+            if len(removed) > 0:
+                removed = set(removed)
+                kept = [e for e in self.index if e.menupath not in removed]
+                index = build_index(kept)
+            else:
+                index = self.index
+
+            entries = build_index(added, start = len(index))
+            index = index + entries
+
+            if len(removed) > 0:
+                self.set_items(None, index = index)
+                return
+
+            self.index = index
+            if self.numpy is None:
+                self.numpy = numpy_index(index)
+            else:
+                self.numpy.extend(index, entries, self.weights)
+            if self._paths is not None:
+                self._paths.add(index, entries)
+            self._items_changed()
+
+    def _items_changed(self):
+        # Stack of (filtertext, matches) for recent searches, each one
+        # narrowing the one below it. Lets typing only search the
+        # previous matches, and backspace reuse them
+        self._history = []
+
+        self.generation += 1
+        self._cache.clear()
+        self._speculated = {}
+        self._speculated_size = 0
+        self._partial = None
+
+    def search(self, query, limit = 15):
+        """Returns SearchResults for the limit best items matching query,
+        as if it was typed into tabtabtab
+        """
+        with self._lock:
+            ranking = self.rank(normalise_filter(query), count = limit)
+            self.record(ranking)
+            return ranking.results(limit)
+
+    def search_many(self, queries, limit = 15):
+        """search() for each of the queries, in order. Queries which
+        extend the previous one (as when typing) only search its matches
+        """
+        with self._lock:
+            return [self.search(query, limit = limit) for query in queries]
+
+    def rank(self, filtertext, count = 0):
+        """Returns the Ranking for filtertext (see normalise_filter),
+        searching on this thread unless it is cached. The best count
+        entries are sorted
+        """
+        with self._lock:
+            ranking, job = self._search_job(filtertext, count, self.weights)
+            if ranking is None:
+                ranking = job()
+                self.store(ranking)
+            return ranking
+
+    def search_job(self, filtertext, count = 0):
+        """Returns (ranking, None) if the Ranking for filtertext is
+        cached. Otherwise returns (None, job), where job(is_cancelled)
+        searches without using the engine, so it can be run on another
+        thread. It returns the Ranking (which can be given to store()),
+        or None if is_cancelled() returned True
+        """
+        with self._lock:
+            return self._search_job(filtertext, count, self.weights.snapshot())
+
+    def _search_job(self, filtertext, count, weights):
+        candidates, exact = self._candidates(filtertext)
+
+        ranking = self.cached(filtertext)
+        if ranking is not None:
+            return ranking, None
+
+        key = self._cache_key(filtertext)
+        index = self.index
+        numpy = self.numpy
+
+        def job(is_cancelled = None):
+            ranking = rank_candidates(filtertext, candidates, exact, weights, index, numpy,
+                                      count = count, is_cancelled = is_cancelled)
+            if ranking is not None:
+                ranking.key = key
+            return ranking
+
+        return None, job
+
+    def cached(self, filtertext):
+        """Returns the cached Ranking for filtertext, or None. Speculative
+        results for any other filter text are discarded
+        """
+        with self._lock:
+            key = self._cache_key(filtertext)
+            ranking = self._cache.get(key)
+            if ranking is None and key in self._speculated:
+                ranking = self._speculated[key]
+                self.store(ranking)
+
+            self._speculated = {}
+            self._speculated_size = 0
+            self._partial = None
+            return ranking
+
+    def store(self, ranking):
+        """Caches a Ranking from a search_job
+        """
+        with self._lock:
+            if ranking.index is self.index:
+                self._cache.put(ranking.key, ranking, size = len(ranking))
+
+    def record(self, ranking):
+        """Notes ranking as the latest search, so the next one can search
+        only its matches if it narrows it
+        """
+        with self._lock:
+            if ranking.index is not self.index:
+                # Of items which have since been replaced
+                return
+
+            if len(self._history) == 0 or self._history[-1][0] != ranking.filtertext:
+                self._history.append((ranking.filtertext, ranking.matches))
+
+    def next_filters(self, ranking, count):
+        """Returns up to count of the filter texts likeliest to be
+        searched after ranking's, which narrow it. None are given when
+        ranking has more than SPECULATE_BUDGET matches
+        """
+        if len(ranking) > SPECULATE_BUDGET:
+            return []
+
+        best = ranking.best(100)
+        entries = [ranking.index[i] for i in ranking.ids(best)]
+        scores = [ranking.scores[i] for i in best]
+
+        filtertext = ranking.filtertext
+        texts = []
+        for char in likely_next_chars(filtertext, entries, scores, count):
+            text = normalise_filter(filtertext + char)
+            if text != filtertext and is_narrowing(filtertext, text):
+                texts.append(text)
+        return texts
+
+    def speculate(self, filtertext, ranking, is_cancelled = None, chunk = 1000):
+        """Searches for filtertext, which narrows ranking, keeping the
+        result for cached() if it fits in the SPECULATE_BUDGET. Returns
+        True when done. If is_cancelled returns True (checked after
+        every chunk of ranking's matches) it returns False, and the
+        next call for the same filtertext and ranking carries on from
+        where it stopped
+
+        >>> from data_test import menu_items
+        >>> engine = SearchEngine([{'menupath': p, 'menuobj': None} for p in menu_items], NodeWeights())
+        >>> ranking = engine.rank("b")
+        >>> engine.speculate("bl", ranking, is_cancelled = lambda: True, chunk = 2)
+        False
+        >>> engine.speculate("bl", ranking, chunk = 2)
+        True
+        >>> len(engine.cached("bl"))
+        6
+        """
+        with self._lock:
+            key = self._cache_key(filtertext)
+            if key in self._speculated or ranking.index is not self.index:
+                return True
+
+            partial = self._partial
+            if partial is None or partial[0] != key or partial[1] is not ranking:
+                partial = self._partial = [key, ranking, 0, []]
+
+            candidates = ranking.matches
+            numpy = self.numpy
+            with timings.timed("speculate"):
+                start, found = partial[2], partial[3]
+                while start < len(candidates):
+                    if numpy is not None:
+                        found.extend(numpy.find(filtertext, candidates[start:start + chunk]).tolist())
+                    else:
+                        found.extend(find_matches(filtertext, candidates[start:start + chunk]))
+                    start += chunk
+
+                    # At least one chunk is searched by each call
+                    if start < len(candidates) and is_cancelled is not None and is_cancelled():
+                        partial[2] = start
+                        return False
+
+                self._partial = None
+                if numpy is not None:
+                    np = get_numpy()
+                    found = np.array(found, dtype = np.intp)
+
+                result = rank_candidates(filtertext, found, True, self.weights,
+                                         self.index, numpy)
+            result.key = key
+
+            size = len(result)
+            if self._speculated_size + size <= SPECULATE_BUDGET:
+                self._speculated[key] = result
+                self._speculated_size += size
+            return True
+
+    def _cache_key(self, filtertext):
+        return (filtertext, self.weights.generation, self.generation)
+
+    def _candidates(self, filtertext):
+        """Returns (index entries, exact), where the entries are the
+        matches of a previous search which filtertext narrows, or all
+        of them (or those the PathIndex finds). exact is True if they
+        are the matches for filtertext. With a NumpyIndex, the entries
+        are an array of their ids
+        """
+
+        # Discard searches which filtertext does not narrow (e.g
+        # after backspace or when the text is replaced)
+        while len(self._history) > 0 and not is_narrowing(self._history[-1][0], filtertext):
+            self._history.pop()
+
+        if len(self._history) > 0:
+            prevtext, candidates = self._history[-1]
+            return candidates, prevtext == filtertext
+
+        if self._paths is None:
+            self._paths = PathIndex(self.index)
+        ids = self._paths.candidates(filtertext)
+
+        if self.numpy is not None:
+            if ids is None:
+                return self.numpy.all, False
+            return get_numpy().array(ids, dtype = get_numpy().intp), False
         else:
-            prev_string = " %s" % thing['text']
+            if ids is None:
+                return self.index, False
+            return [self.index[i] for i in ids], False
+
+
+# Filter the node list on a background thread, so typing is never held
+# up by filtering a large number of items
+ASYNC_FILTER = False
 
-        self.input.setText(prev_string)
+# When filtering in the background, milliseconds to wait for another
+# key press before filtering
+FILTER_DEBOUNCE = 0
 
-        # Create node, increment weight and close
-        self.cb_on_create(thing = thing)
-        self.weights.increment(thing['menupath'])
-        self.close()
+
+# Search for the likeliest next characters while the filter text is
+# not changing, so their results can be shown straight away
+SPECULATE = False
+
+# Number of next characters to search for
+SPECULATE_CHARS = 4
+
+# Most matching index entries to keep for the speculative searches.
+# Nothing is searched when there are more matches than this to search
+SPECULATE_BUDGET = 20000
+
+# Longest time in seconds to spend on a speculative search each time
+# the UI is idle
+SPECULATE_SLICE = 0.005
+
+
+# Number of different saturations shown for the weights
+SWATCH_LEVELS = 64
+
+
+# Classes using Qt, defined by load_qt()
+_ResultRelay = NodeModel = NodeListView = TabyLineEdit = TabTabTabWidget = None
+
+
+def load_qt():
+    """Imports the Qt binding and defines the classes using it
+    (NodeModel, TabTabTabWidget etc), the first time it is called.
+    Until then they are None, so must be called before using them.
+    Importing tabtabtab doesn't import any Qt modules:
+
+    >>> import subprocess
+    >>> print subprocess.check_output([sys.executable, "-c",
+    ...     "import sys, tabtabtab; print sorted(m for m in sys.modules"
+    ...     " if m.split('.')[0] in ('PySide2', 'PySide', 'PyQt4', 'PyQt5', 'sip'))"],
+    ...     cwd = os.path.dirname(os.path.abspath(__file__))).strip()
+    []
+    """
+    global _ResultRelay, NodeModel, NodeListView, TabyLineEdit, TabTabTabWidget
+
+    if TabTabTabWidget is not None:
+        return
+
+    _import_qt()
+
+    class _ResultRelay(QtCore.QObject):
+        """Passes results from the FilterWorker thread to the UI thread
+        """
+        finished = QtCore.Signal(object)
+
+
+    class NodeModel(QtCore.QAbstractListModel):
+        def __init__(self, mlist, weights, num_items = 15, filtertext = "", index = None,
+                     asynchronous = False, debounce = 0, speculate = False):
+            """Shows the results of a SearchEngine for mlist. If
+            asynchronous is True, set_filter searches on a background
+            thread, after waiting for debounce milliseconds without another
+            call. If speculate is True, the results for the likeliest next
+            filter texts are searched for while idle
+            """
+            super(NodeModel, self).__init__()
+
+            self.engine = SearchEngine(mlist, weights, index = index)
+            self.num_items = num_items
+            self.debounce = debounce
+
+            # True while results for the current filter text are still
+            # being computed in the background
+            self._waiting = False
+
+            self._worker = None
+            if asynchronous:
+                self._worker = FilterWorker()
+
+                self._relay = _ResultRelay()
+                self._relay.finished.connect(self._on_result, Qt.QueuedConnection)
+
+                self._debounce_timer = QtCore.QTimer(self)
+                self._debounce_timer.setSingleShot(True)
+                self._debounce_timer.setInterval(debounce)
+                self._debounce_timer.timeout.connect(self._submit)
+
+            # Filter texts which might be typed next, still to be
+            # searched for while idle
+            self.speculate = speculate
+            self._speculating = []
+            if speculate:
+                self._speculate_timer = QtCore.QTimer(self)
+                self._speculate_timer.setInterval(0)
+                self._speculate_timer.timeout.connect(self._speculate_step)
+
+            self._filtertext = filtertext
+
+            # Ranking of the current filter text, and the ids, scores
+            # and text of the index entries shown from it. update sets
+            # these
+            self._ranking = None
+            self._rows = []
+            self._row_scores = []
+
+            # {(level, row % 2): QPixmap} of the weight swatches, kept
+            # here so none outlive the QApplication
+            self._swatches = {}
+            self._row_text = []
+            self.update()
+
+        @property
+        def weights(self):
+            return self.engine.weights
+
+        def set_items(self, mlist, index = None):
+            """Replaces the list of items being searched. index can be given
+            if build_index(mlist) was already done
+            """
+            self.engine.set_items(mlist, index = index)
+            self._items_changed()
+
+        def patch_items(self, added, removed):
+            """Adds the items in the list added, and removes the ones with
+            menupaths in removed, only building the index for the new items
+            """
+            self.engine.patch_items(added, removed)
+            self._items_changed()
+
+        def _items_changed(self):
+            self._stop_speculating()
+
+            if self._worker is not None:
+                # Any search still running is of the old items
+                self._worker.cancel()
+                self._waiting = False
+
+            self.update()
+
+        def set_filter(self, filtertext):
+            self._filtertext = filtertext
+            self._stop_speculating()
+
+            if self._worker is None:
+                self.update()
+            else:
+                self._waiting = True
+                if self.debounce > 0:
+                    # Restarts the timer if already waiting
+                    self._debounce_timer.start()
+                else:
+                    self._submit()
+
+        def _normalised_filter(self):
+            return normalise_filter(self._filtertext)
+
+        def update(self):
+            """Filters and ranks the items for the current filter text,
+            on this thread
+            """
+            self._apply(self.engine.rank(self._normalised_filter(), count = self.num_items))
+
+        def flush(self):
+            """Makes sure the results are for the current filter text, if
+            filtering in the background
+            """
+            if not self._waiting:
+                return
+
+            self._debounce_timer.stop()
+            self._worker.cancel()
+            self._waiting = False
+            self.update()
+
+        def _submit(self):
+            """Starts filtering for the current filter text on the
+            FilterWorker thread, cancelling any earlier search
+            """
+            ranking, job = self.engine.search_job(self._normalised_filter(), count = self.num_items)
+            if ranking is not None:
+                self._worker.cancel()
+                self._waiting = False
+                self._apply(ranking)
+                return
+
+            self._waiting = True
+            self._worker.submit(job, self._relay.finished.emit)
+
+        def _on_result(self, result):
+            """Receives results from the FilterWorker thread
+            """
+            generation, ranking = result
+            if generation != self._worker.generation:
+                # A newer search has been started
+                return
+
+            self._waiting = False
+            self.engine.store(ranking)
+            self._apply(ranking)
+
+        def _stop_speculating(self):
+            if self.speculate:
+                self._speculate_timer.stop()
+                self._speculating = []
+
+        def _speculate_step(self):
+            """Searches for one of the filter texts which might be typed
+            next
+            """
+            if len(self._speculating) == 0:
+                self._speculate_timer.stop()
+                return
+
+            # Stop after SPECULATE_SLICE, carrying on from there on the
+            # next step, so typing isn't held up
+            deadline = time.time() + SPECULATE_SLICE
+            done = self.engine.speculate(
+                self._speculating[0], self._ranking,
+                is_cancelled = lambda: time.time() > deadline)
+            if done:
+                self._speculating.pop(0)
+
+        def _apply(self, ranking):
+            self.engine.record(ranking)
+
+            self._ranking = ranking
+            self._set_rows(ranking.best(self.num_items))
+            self.modelReset.emit()
+
+            if self.speculate:
+                self._speculating = self.engine.next_filters(ranking, SPECULATE_CHARS)
+                if len(self._speculating) > 0:
+                    self._speculate_timer.start()
+
+        def _set_rows(self, best):
+            """Shows the matches at the positions in best
+            """
+            ranking = self._ranking
+            self._rows = ranking.ids(best)
+            self._row_scores = [float(ranking.scores[i]) for i in best]
+            self._row_text = [ranking.index[i].text for i in self._rows]
+
+        def rowCount(self, parent = QtCore.QModelIndex()):
+            return len(self._rows)
+
+        def canFetchMore(self, parent = QtCore.QModelIndex()):
+            return len(self._rows) < len(self._ranking)
+
+        def fetchMore(self, parent = QtCore.QModelIndex()):
+            """Ranks another num_items matches, when the view wants to show
+            more than the first page
+            """
+            start = len(self._rows)
+            best = self._ranking.best(start + self.num_items)
+
+            self.beginInsertRows(QtCore.QModelIndex(), start, len(best) - 1)
+            self._set_rows(best)
+            self.endInsertRows()
+
+        def _swatch(self, weight, row):
+            """Returns the pixmap showing a weight in the given row. The
+            pixmaps are cached for each of the SWATCH_LEVELS, in odd and
+            even rows
+            """
+            level = int(round(min(max(weight, 0.0), 1.0) * (SWATCH_LEVELS - 1)))
+            key = (level, row % 2)
+
+            pix = self._swatches.get(key)
+            if pix is None:
+                hue = 0.4
+                sat = level / float(SWATCH_LEVELS - 1)
+
+                if row % 2 == 0:
+                    col = QtGui.QColor.fromHsvF(hue, sat, 0.9)
+                else:
+                    col = QtGui.QColor.fromHsvF(hue, sat, 0.8)
+
+                pix = QtGui.QPixmap(6, 12)
+                pix.fill(col)
+                self._swatches[key] = pix
+            return pix
+
+        def data(self, index, role = Qt.DisplayRole):
+            if role == Qt.DisplayRole:
+                # Return text to display
+                return self._row_text[index.row()]
+
+            elif role == Qt.DecorationRole:
+                return self._swatch(self._row_scores[index.row()], index.row())
+
+            elif role == Qt.BackgroundRole:
+                return
+                weight = self._row_scores[index.row()]
+
+                hue = 0.4
+                sat = weight ** 2 # gamma saturation to make faster falloff
+
+                sat = min(1.0, sat)
+
+                if index.row() % 2 == 0:
+                    return QtGui.QColor.fromHsvF(hue, sat, 0.9)
+                else:
+                    return QtGui.QColor.fromHsvF(hue, sat, 0.8)
+            else:
+                # Ignore other roles
+                return None
+
+        def getorig(self, selected):
+            # TODO: Is there a way to get this via data()? There's no
+            # Qt.DataRole or something (only DisplayRole)
+
+            if len(selected) > 0:
+                # Get first selected index
+                selected = selected[0]
+
+            else:
+                # Nothing selected, get first index
+                selected = self.index(0)
+
+            # TODO: Maybe check for IndexError?
+            row = selected.row()
+            entry = self._ranking.index[self._rows[row]]
+            return {'text': entry.text,
+                    'menupath': entry.menupath,
+                    'menuobj': entry.menuobj,
+                    'score': self._row_scores[row]}
+
+
+    class NodeListView(QtWidgets.QListView):
+        def paintEvent(self, event):
+            with timings.timed("repaint"):
+                super(NodeListView, self).paintEvent(event)
+
+
+    class TabyLineEdit(QtWidgets.QLineEdit):
+        pressed_arrow = QtCore.Signal(str)
+        cancelled = QtCore.Signal()
+
+
+        def event(self, event):
+            """Make tab trigger returnPressed
+
+            Also emit signals for the up/down arrows, and escape.
+            """
+
+            is_keypress = event.type() == QtCore.QEvent.KeyPress
+
+            if is_keypress and event.key() == QtCore.Qt.Key_Tab:
+                # Can't access tab key in keyPressedEvent
+                self.returnPressed.emit()
+                return True
+
+            elif is_keypress and event.key() == QtCore.Qt.Key_Up:
+                # These could be done in keyPressedEvent, but.. this is already here
+                self.pressed_arrow.emit("up")
+                return True
+
+            elif is_keypress and event.key() == QtCore.Qt.Key_Down:
+                self.pressed_arrow.emit("down")
+                return True
+
+            elif is_keypress and event.key() == QtCore.Qt.Key_Escape:
+                self.cancelled.emit()
+                return True
+
+            else:
+                return super(TabyLineEdit, self).event(event)
+
+
+    class TabTabTabWidget(QtWidgets.QDialog):
+        def __init__(self, on_create = None, parent = None, winflags = None, deferred = False):
+            """If deferred is True, loading the weights and menu items is
+            left until build_slice or finish_build are called
+            """
+            super(TabTabTabWidget, self).__init__(parent = parent)
+            if winflags is not None:
+                self.setWindowFlags(winflags)
+
+            self.setMinimumSize(200, 300)
+            self.setMaximumSize(200, 300)
+
+            # Store callback
+            self.cb_on_create = on_create
+
+            # Input box
+            self.input = TabyLineEdit()
+
+            # Node weighting
+            self.weights = default_weights()
+
+            # Weights are saved on a background thread, make sure they are
+            # written before Nuke exits
+            app = QtWidgets.QApplication.instance()
+            if app is not None:
+                app.aboutToQuit.connect(flush_weights)
+
+            # Menu items, from the cache when possible as walking the
+            # menus is slow. The cache is checked after the first close
+            self.menu_cache = MenuCache(os.path.expanduser("~/.nuke/tabtabtab_menucache.json"))
+            self._menus_checked = False
+            self.menu_tree = MenuTree()
+
+            # List of stuff, and associated model. Filled in by build_steps
+            self.things_model = NodeModel(
+                [], weights = self.weights,
+                asynchronous = ASYNC_FILTER, debounce = FILTER_DEBOUNCE,
+                speculate = SPECULATE)
+            self.things = NodeListView()
+            self.things.setModel(self.things_model)
+
+            # Only num_items rows fit, and arrow keys wrap around them
+            self.things.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+
+            # Every row is a line of text, so the view does not need to
+            # measure each one
+            self.things.setUniformItemSizes(True)
+
+            # Add input and items to layout
+            layout = QtWidgets.QVBoxLayout()
+            layout.addWidget(self.input)
+            layout.addWidget(self.things)
+
+            # Remove margins
+            layout.setContentsMargins(0, 0, 0, 0)
+            self.setLayout(layout)
+
+            # Update on text change
+            self.input.textChanged.connect(self.update)
+
+            # Reset selection on text change, and when the results arrive
+            # when filtering in the background
+            self.input.textChanged.connect(lambda: self.move_selection(where="first"))
+            self.things_model.modelReset.connect(lambda: self.move_selection(where="first"))
+            self.move_selection(where = "first") # Set initial selection
+
+            # Create node when enter/tab is pressed, or item is clicked
+            self.input.returnPressed.connect(self.create)
+            self.things.clicked.connect(self.create)
+
+            # When esc pressed, close
+            self.input.cancelled.connect(self.close)
+
+            # Up and down arrow handling
+            self.input.pressed_arrow.connect(self.move_selection)
+
+            self._build = self.build_steps()
+            if not deferred:
+                self.finish_build()
+
+        def build_steps(self):
+            """Generator which loads the weights and menu items, and builds
+            the search index, yielding between each small step
+            """
+            self.weights.load() # weights.save() called in close method
+            yield
+
+            nodes = self.menu_cache.load()
+            walked = nodes is None
+            if walked:
+                nodes = []
+                for items in iter_nuke_menu_items():
+                    nodes.extend(items)
+                    yield
+                self._menus_checked = True
+            yield
+
+            index = []
+            chunk = 250
+            for start in range(0, len(nodes), chunk):
+                index.extend(build_index(nodes[start:start + chunk], start = start))
+                yield
+
+            if walked:
+                self.menu_cache.save(index)
+
+            self.things_model.set_items(None, index = index)
+            self.move_selection(where = "first")
+
+        def build_slice(self, duration = 0.01):
+            """Runs build_steps for roughly duration seconds. Returns True
+            once everything is built
+            """
+            deadline = time.time() + duration
+            for _ in self._build:
+                if time.time() > deadline:
+                    return False
+            return True
+
+        def finish_build(self):
+            """Runs any remaining build_steps
+            """
+            for _ in self._build:
+                pass
+
+        def under_cursor(self):
+            def clamp(val, mi, ma):
+                return max(min(val, ma), mi)
+
+            # Get cursor position, and screen dimensions on active screen
+            cursor = QtGui.QCursor().pos()
+            screen = QtWidgets.QDesktopWidget().screenGeometry(cursor)
+
+            # Get window position so cursor is just over text input
+            xpos = cursor.x() - (self.width()/2)
+            ypos = cursor.y() - 13
+
+            # Clamp window location to prevent it going offscreen
+            xpos = clamp(xpos, screen.left(), screen.right() - self.width())
+            ypos = clamp(ypos, screen.top(), screen.bottom() - (self.height()-13))
+
+            # Move window
+            self.move(xpos, ypos)
+
+        def move_selection(self, where):
+            if where not in ["first", "up", "down"]:
+                raise ValueError("where should be either 'first', 'up', 'down', not %r" % (
+                        where))
+
+            first = where == "first"
+            up = where == "up"
+            down = where == "down"
+
+            if first:
+                self.things.setCurrentIndex(self.things_model.index(0))
+                return
+
+            cur = self.things.currentIndex()
+            if up:
+                new = cur.row() - 1
+                if new < 0:
+                    new = self.things_model.rowCount() - 1
+            elif down:
+                new = cur.row() + 1
+                count = self.things_model.rowCount()
+                if new > count-1:
+                    new = 0
+
+            self.things.setCurrentIndex(self.things_model.index(new))
+
+        def event(self, event):
+            """Close when window becomes inactive (click outside of window)
+            """
+            if event.type() == QtCore.QEvent.WindowDeactivate:
+                self.close()
+                return True
+            else:
+                return super(TabTabTabWidget, self).event(event)
+
+        def update(self, text):
+            """On text change, selects first item and updates filter text
+            """
+            self.things.setCurrentIndex(self.things_model.index(0))
+            self.things_model.set_filter(text)
+
+        def show(self):
+            """Select all the text in the input (which persists between
+            show()'s)
+
+            Allows typing over previously created text, and [tab][tab] to
+            create previously created node (instead of the most popular)
+            """
+
+            # Load the weights everytime the panel is shown, to prevent
+            # overwritting weights from other Nuke instances
+            self.weights.load()
+
+            # Select all text to allow overwriting
+            self.input.selectAll()
+            self.input.setFocus()
+
+            super(TabTabTabWidget, self).show()
+
+        def close(self):
+            """Save weights when closing
+            """
+            self.weights.save_async()
+            super(TabTabTabWidget, self).close()
+
+            if not self._menus_checked:
+                # Nuke's menus can only be accessed from the main thread,
+                # so check them once the event loop is idle again
+                self._menus_checked = True
+                QtCore.QTimer.singleShot(0, self.check_menus)
+
+        def check_menus(self):
+            """Walks the menus, updating the cache and list of items if
+            they differ from the cached items
+            """
+            self.refresh_menus()
+
+        def refresh_menus(self):
+            """Updates the list of items with changes made to the menus. The
+            first call walks every menu, later ones only look at the items
+            of menus which changed since
+            """
+            self.finish_build()
+
+            first = not self.menu_tree.walked
+            entries, added, removed = self.menu_tree.walk()
+
+            if first:
+                # Search the MenuTree's entries even if they are the same,
+                # so only one copy of the index is kept
+                if not same_menu_items(entries, self.things_model.engine.index):
+                    self.menu_cache.save(entries)
+                self.things_model.set_items(None, index = entries)
+            elif len(added) > 0 or len(removed) > 0:
+                self.things_model.patch_items(added, removed)
+                index = self.things_model.engine.index
+                self.menu_tree.adopt(index)
+                self.menu_cache.save(index)
+
+        def create(self):
+            # Make sure the list is for the current text
+            self.things_model.flush()
+
+            # Get selected item
+            selected = self.things.selectedIndexes()
+            if len(selected) == 0:
+                return
+
+            thing = self.things_model.getorig(selected)
+
+            # Store the full UI name of the created node, so it is the
+            # active node on the next [tab]. Prefix it with space,
+            # to disable substring matching
+            if thing['text'].startswith(" "):
+                prev_string = thing['text']
+            else:
+                prev_string = " %s" % thing['text']
+
+            self.input.setText(prev_string)
+
+            # Create node, increment weight and close
+            with timings.timed("create"):
+                self.cb_on_create(thing = thing)
+            self.weights.increment(thing['menupath'])
+            self.close()
+
+
+def _on_create(thing):
+    try:
+        thing['menuobj'].invoke()
+    except ImportError:
+        print "Error creating %s" % thing
+
+
+# Widget built by warmup(), not yet shown by main()
+_tabtabtab_warm = None
+
+def warmup(delay = 2000, duration = 0.01):
+    """Builds tabtabtab in small steps while Nuke is idle, starting
+    after delay milliseconds, so the first [tab] only has to show it.
+    Each step takes roughly duration seconds.
+
+    Call from menu.py, after adding the main() command
+    """
+    global _tabtabtab_warm
+
+    if _tabtabtab_instance is not None or _tabtabtab_warm is not None:
+        return
+
+    load_qt()
+    t = TabTabTabWidget(on_create = _on_create, winflags = Qt.FramelessWindowHint, deferred = True)
+    _tabtabtab_warm = t
+
+    def step():
+        try:
+            finished = t.build_slice(duration = duration)
+        except Exception:
+            print "Error building tabtabtab"
+            import traceback
+            traceback.print_exc()
+            finished = True
+        if finished:
+            timer.stop()
+
+    timer = QtCore.QTimer(t)
+    timer.timeout.connect(step)
+    QtCore.QTimer.singleShot(delay, timer.start)
+
+    def discard():
+        # Don't keep the widget alive on exit, see main()
+        global _tabtabtab_warm
+        _tabtabtab_warm = None
+    QtWidgets.QApplication.instance().aboutToQuit.connect(discard)
+
+
+def refresh_menus():
+    """Adds nodes added to the menus since tabtabtab was built, and
+    removes deleted ones. Call after changing the menus, for example
+    after loading more gizmos
+    """
+    for t in (_tabtabtab_instance, _tabtabtab_warm):
+        if t is not None:
+            t.refresh_menus()
 
 
 _tabtabtab_instance = None
 def main():
-    global _tabtabtab_instance
+    global _tabtabtab_instance, _tabtabtab_warm
 
     if _tabtabtab_instance is not None:
         # TODO: Is there a better way of doing this? If a
@@ -541,13 +3208,14 @@ def main():
         _tabtabtab_instance.raise_()
         return
 
-    def on_create(thing):
-        try:
-            thing['menuobj'].invoke()
-        except ImportError:
-            print "Error creating %s" % thing
-
-    t = TabTabTabWidget(on_create = on_create, winflags = Qt.FramelessWindowHint)
+    if _tabtabtab_warm is not None:
+        # Finish anything warmup() has not done yet
+        t = _tabtabtab_warm
+        _tabtabtab_warm = None
+        t.finish_build()
+    else:
+        load_qt()
+        t = TabTabTabWidget(on_create = _on_create, winflags = Qt.FramelessWindowHint)
 
     # Make dialog appear under cursor, as Nuke's builtin one does
     t.under_cursor()
@@ -570,6 +3238,7 @@ if __name__ == '__main__':
         m_edit.addCommand("Tabtabtab", main, "Tab")
     except ImportError:
         # For testing outside Nuke
-        app = QtGui.QApplication(sys.argv)
+        load_qt()
+        app = QtWidgets.QApplication(sys.argv)
         main()
         app.exec_()